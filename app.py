@@ -1,6 +1,9 @@
 from dash import Dash, page_container, html
 import dash_bootstrap_components as dbc
 
+from src.downloads import downloads
+from src.api import api
+
 meta = {
     "name": "viewport", 
     "content": "width=device-width, initial-scale=1"}
@@ -20,6 +23,8 @@ app.layout = dbc.Container(
 )
 
 server = app.server
+server.register_blueprint(downloads)
+server.register_blueprint(api)
 
 if __name__ == '__main__':
 	app.run_server(
@@ -0,0 +1,161 @@
+/*
+ * Browser-side mirror of `src.filters.get_filter_mask`, used when the
+ * dashboard runs with CLIENT_FILTERING. The columns are shipped once per
+ * dataset version by `src.filters.get_client_columns`.
+ */
+(function() {
+    var decoded = {version: null, columns: {}};
+    var last = {key: null, mask: null};
+    var committed = null;
+
+    function column(payload, c) {
+        if (decoded.version !== payload.version) {
+            decoded = {version: payload.version, columns: {}};
+        }
+
+        if (!(c in decoded.columns)) {
+            var col = payload.columns[c];
+            if (!col) {
+                return null;
+            }
+
+            var bin = atob(col.data);
+            var bytes = new Uint8Array(bin.length);
+            for (var i = 0; i < bin.length; i++) {
+                bytes[i] = bin.charCodeAt(i);
+            }
+
+            decoded.columns[c] = {
+                values: col.dtype === 'float64'
+                    ? new Float64Array(bytes.buffer)
+                    : new Int32Array(bytes.buffer),
+                categories: col.categories
+            };
+        }
+
+        return decoded.columns[c];
+    }
+
+    function nulls(col) {
+        var values = col.values;
+        var m = new Uint8Array(values.length);
+        for (var i = 0; i < values.length; i++) {
+            m[i] = col.categories ? values[i] < 0 : isNaN(values[i]);
+        }
+        return m;
+    }
+
+    function isin(col, wanted) {
+        wanted = new Set(wanted || []);
+
+        var codes = new Uint8Array(col.categories.length);
+        col.categories.forEach(function(v, k) {
+            codes[k] = wanted.has(v);
+        });
+
+        // like pandas.isin, a null in `wanted` matches null rows
+        var withNull = wanted.has(null);
+
+        var values = col.values;
+        var m = new Uint8Array(values.length);
+        for (var i = 0; i < values.length; i++) {
+            m[i] = values[i] < 0 ? withNull : codes[values[i]];
+        }
+        return m;
+    }
+
+    function between(col, range) {
+        var lo = range[0], hi = range[1];
+
+        var values = col.values;
+        var m = new Uint8Array(values.length);
+        for (var i = 0; i < values.length; i++) {
+            m[i] = values[i] >= lo && values[i] <= hi;
+        }
+        return m;
+    }
+
+    function and(mask, m) {
+        for (var i = 0; i < mask.length; i++) {
+            mask[i] &= m[i];
+        }
+    }
+
+    function mask(payload, legend, dope, apply, values, ids, nullValues) {
+        var key = JSON.stringify(
+            [payload.version, legend, dope, apply, values, ids, nullValues]
+        );
+        if (last.key === key) {
+            return last.mask;
+        }
+
+        var m = new Uint8Array(payload.n).fill(1);
+        and(m, isin(column(payload, payload.category), legend));
+        and(m, isin(column(payload, payload.dope), dope));
+
+        if (apply && values && values.length) {
+            ids.forEach(function(id, i) {
+                var col = column(payload, id.column);
+                if (!col) {
+                    return;
+                }
+
+                var keep = col.categories
+                    ? isin(col, values[i])
+                    : between(col, values[i]);
+
+                if (nullValues[i] && nullValues[i].length) {
+                    var n = nulls(col);
+                    for (var j = 0; j < keep.length; j++) {
+                        keep[j] |= n[j];
+                    }
+                }
+
+                and(m, keep);
+            });
+        }
+
+        last = {key: key, mask: m};
+        return m;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        filters: {
+            mask: mask,
+
+            /*
+             * Record the latest filter state and when it changed.
+             */
+            pending: function(legend, dope, apply, values, ids, nullValues) {
+                var state = [legend, dope, apply, values, ids, nullValues];
+
+                // the page was rendered with the initial state
+                if (committed === null) {
+                    committed = JSON.stringify(state);
+                }
+
+                return {state: state, t: Date.now()};
+            },
+
+            /*
+             * Hand the filter state to the server once it has been
+             * left alone for two ticks of the `interval` (ms), so
+             * dragging a slider only recomputes the fits and tables
+             * when it comes to rest.
+             */
+            commit: function(n, pending, interval) {
+                if (!pending || Date.now() - pending.t < 2*interval) {
+                    return window.dash_clientside.no_update;
+                }
+
+                var key = JSON.stringify(pending.state);
+                if (key === committed) {
+                    return window.dash_clientside.no_update;
+                }
+
+                committed = key;
+                return pending.t;
+            }
+        }
+    });
+})();
@@ -0,0 +1,84 @@
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    graphs: {
+        /*
+         * Copy a figure rendered by the server with linear axes onto
+         * its graph, switching the axes the "Log X"/"Log Y" toggles ask
+         * for. Only axes offered in `options` are touched, so category
+         * axes are left alone.
+         */
+        apply_log: function(figure, log, options) {
+            if (!figure) {
+                return window.dash_clientside.no_update;
+            }
+
+            log = log || [];
+            options = (options || []).map(function(o) {
+                return o.value !== undefined ? o.value : o;
+            });
+
+            var layout = Object.assign({}, figure.layout);
+            var logy = log.indexOf('Log Y') >= 0;
+
+            [['Log X', 'xaxis'], ['Log Y', 'yaxis']].forEach(function(a) {
+                if (options.indexOf(a[0]) >= 0) {
+                    layout[a[1]] = Object.assign({}, layout[a[1]], {
+                        type: log.indexOf(a[0]) >= 0 ? 'log' : 'linear'
+                    });
+                }
+            });
+
+            // annotations on a log axis are positioned in log10 units
+            var ys = (layout.meta && layout.meta.annotation_y) || [];
+            if (ys.length && layout.annotations) {
+                layout.annotations = layout.annotations.map(function(a, i) {
+                    if (i >= ys.length) {
+                        return a;
+                    }
+                    return Object.assign({}, a, {
+                        y: logy ? Math.log10(ys[i]) : ys[i]
+                    });
+                });
+            }
+
+            return Object.assign({}, figure, {layout: layout});
+        },
+
+        /*
+         * Like `apply_log`, first hiding the points (traces with `ids`,
+         * the row numbers of the dataset) that the current filter state
+         * excludes, without waiting for the server.
+         */
+        apply_filters: function(
+            figure, log, legend, dope, apply, values, ids, nullValues,
+            options, columns
+        ) {
+            if (figure && columns) {
+                var m = window.dash_clientside.filters.mask(
+                    columns, legend, dope, apply, values, ids, nullValues
+                );
+
+                figure = Object.assign({}, figure, {
+                    data: figure.data.map(function(trace) {
+                        if (!trace.ids) {
+                            return trace;
+                        }
+
+                        var selected = [];
+                        for (var i = 0; i < trace.ids.length; i++) {
+                            if (m[+trace.ids[i]]) {
+                                selected.push(i);
+                            }
+                        }
+
+                        return Object.assign({}, trace, {
+                            selectedpoints: selected,
+                            unselected: {marker: {opacity: 0}}
+                        });
+                    })
+                });
+            }
+
+            return window.dash_clientside.graphs.apply_log(figure, log, options);
+        }
+    }
+});
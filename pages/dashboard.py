@@ -7,27 +7,44 @@ import dash
 from dash import (
     Dash, dcc, html, Input, Output, State, 
     page_container, callback, dash_table, ctx,
-    ALL
+    ALL, no_update, ClientsideFunction
 )
 import dash_bootstrap_components as dbc
 import dash_daq as daq
 
 # Other
 import os
-import pandas as pd
-import numpy as np
-import scipy.stats as stats
 import time
+import tempfile
 
 # Common
 from src.common import CATEGORY_MAPPER
-from src.db import get_dd, get_df, get_df_for_download
+from src.db import (
+    load_dataset, resolve_version, get_dataset, on_dataset_load
+)
+from src.downloads import sign_download, write_export, EXPORT_FORMATS
 from src.plotting import MARKERS, construct_fig1, construct_fig2
-from src.benchmarks import (compute_bm_g1, compute_bm_g2)
-from src.filters import generate_filter_control, get_filter_mask
+from src.analytics import category_summary
+from src.correlations import get_cube
+from src.benchmarks import (
+    compute_bm_g1, compute_bm_g2, get_benchmark_table
+)
+from src.filters import (
+    generate_filter_control, get_filter_mask, filter_state_key,
+    get_client_columns
+)
+from src.profiles import get_column_profiles
+from src.figcache import (
+    cached_figure, cached_value, figure_key, register_render_source
+)
+from collections import Counter
+import json
 
 dash.register_page(__name__, path='/', title='CNT Meta-Analysis')
 
+# the tables cached below are built in this file
+register_render_source(__file__)
+
 
 # -------------------------- CONSTANTS & STYLE --------------------------------
 #
@@ -55,6 +72,42 @@ conductivity. Use the charts to explore data from CNT studies.
 Want your study included? Click here.
 """
 
+DEFAULT_LEGEND = [
+    c for c in CATEGORY_MAPPER.keys() 
+     if CATEGORY_MAPPER[c] != 'Other'
+    and c not in ['Single crystal graphite', 
+                     'Unaligned multiwall CNTs',
+                     'Unaligned Few-wall CNTs',
+                     'Conductive Polymer'
+                 ]
+]
+
+DEFAULT_DOPE = ['Yes', 'No']
+
+# Initial values of the graph controls.
+DEFAULT_VIEW = {
+    'g1y': 'Conductivity (MSm-1)',
+    'g1log': ['Log Y'],
+    'g1opts': ['Show Benchmarks'],
+    'g2x': 'Tensile Strength (MPa)',
+    'g2y': 'Conductivity (MSm-1)',
+    'g2log': ['Log Y', 'Log X'],
+    'g2opts': [],
+    'g3y': 'Conductivity (MSm-1)',
+    'g3log': ['Log Y'],
+    'g3opts': ['Show Benchmarks'],
+}
+
+# Number of most-requested views, beyond the default one,
+# rendered ahead of time when a dataset version loads.
+WARM_TOP_N = int(os.environ.get('WARM_TOP_N', 0))
+
+# With CLIENT_FILTERING=1, filtering is previewed in the browser
+# (assets/filters.js) and the server only recomputes fits, boxes and
+# tables once the filters have been left alone for FILTER_DEBOUNCE_MS.
+CLIENT_FILTERING = bool(int(os.environ.get('CLIENT_FILTERING', 0)))
+FILTER_DEBOUNCE_MS = int(os.environ.get('FILTER_DEBOUNCE_MS', 400))
+
 
 # ------------------------------ PREDEFINED LAYOUT ELEMENTS -------------------
 #
@@ -269,16 +322,7 @@ def serve_sidebar(df):
             children=[
                 dcc.Checklist(
                     mat_ops, 
-                    [
-                        c for c in CATEGORY_MAPPER.keys() 
-                         if CATEGORY_MAPPER[c] != 'Other'
-                             
-                             and c not in ['Single crystal graphite', 
-                             'Unaligned multiwall CNTs',
-                             'Unaligned Few-wall CNTs',
-                             'Conductive Polymer'
-                         ]
-                    ], 
+                    DEFAULT_LEGEND, 
                     labelStyle={'display': 'block'},
                     labelClassName='m-1',
                     style={
@@ -316,7 +360,7 @@ def serve_sidebar(df):
                 {'label': 'Doped', 'value': 'Yes'},
                 {'label': 'Undoped', 'value': 'No'},
             ],
-            ['Yes', 'No'], 
+            DEFAULT_DOPE, 
             id='dope-control',
             inputStyle={'margin-right': '2px'},
             labelClassName='m-1',
@@ -333,7 +377,7 @@ def serve_sidebar(df):
     print(df.columns)
     
     search_bar = dcc.Dropdown(
-        df['Reference'].unique(), 
+        df['Reference'].unique().tolist(), 
         [], 
         multi=True, 
         placeholder='Search papers', 
@@ -449,7 +493,7 @@ def serve_content(df, dd):
                     dbc.Col(
                         dcc.Dropdown(
                             graph1_y_dropdown, 
-                            'Conductivity (MSm-1)', 
+                            DEFAULT_VIEW['g1y'], 
                             multi=False, 
                             placeholder='Pick Y-axis', 
                             id='graph1-yaxis-dropdown'
@@ -458,14 +502,27 @@ def serve_content(df, dd):
                         sm=6
                     ),
                     dbc.Col(
-                        dcc.Checklist(
-                            ['Log Y', 'Squash', 'Show Benchmarks'], 
-                            ['Log Y', 'Show Benchmarks'], 
-                            id='graph1-log',
-                            inline=True,
-                            inputStyle={'margin-right': '5px'},
-                            labelStyle={'margin-right': '10px'}
-                        ),
+                        [
+                            # log toggles are applied in the browser
+                            dcc.Checklist(
+                                ['Log Y'], 
+                                DEFAULT_VIEW['g1log'], 
+                                id='graph1-log',
+                                inline=True,
+                                inputStyle={'margin-right': '5px'},
+                                labelStyle={'margin-right': '10px'},
+                                style={'display': 'inline-block'}
+                            ),
+                            dcc.Checklist(
+                                ['Squash', 'Show Benchmarks'], 
+                                DEFAULT_VIEW['g1opts'], 
+                                id='graph1-opts',
+                                inline=True,
+                                inputStyle={'margin-right': '5px'},
+                                labelStyle={'margin-right': '10px'},
+                                style={'display': 'inline-block'}
+                            ),
+                        ],
                         md=6,
                         sm=7,
                         className='pt-2'
@@ -477,7 +534,10 @@ def serve_content(df, dd):
             dbc.Row([
                 dbc.Col(
                     id='graph1', 
-                    children=dcc.Graph()
+                    children=[
+                        dcc.Graph(id='graph1-fig'),
+                        dcc.Store(id='graph1-base')
+                    ]
                 )
             ]),
             
@@ -501,7 +561,7 @@ def serve_content(df, dd):
                     dbc.Col(
                         dcc.Dropdown(
                             graph1_y_dropdown, 
-                            'Tensile Strength (MPa)', 
+                            DEFAULT_VIEW['g2x'], 
                             multi=False, 
                             placeholder='Pick X-axis', 
                             id='graph2-xaxis-dropdown'
@@ -512,7 +572,7 @@ def serve_content(df, dd):
                     dbc.Col(
                         dcc.Dropdown(
                             graph1_y_dropdown, 
-                            'Conductivity (MSm-1)', 
+                            DEFAULT_VIEW['g2y'], 
                             multi=False, 
                             placeholder='Pick Y-axis', 
                             id='graph2-yaxis-dropdown'
@@ -521,14 +581,27 @@ def serve_content(df, dd):
                         sm=6
                     ),
                     dbc.Col(
-                        dcc.Checklist(
-                            ['Log Y', 'Log X', 'Squash', 'Show Benchmarks'], 
-                            ['Log Y', 'Log X'], 
-                            id='graph2-log',
-                            inline=True,
-                            inputStyle={'margin-right': '5px'},
-                            labelStyle={'margin-right': '10px'}
-                        ),
+                        [
+                            # log toggles are applied in the browser
+                            dcc.Checklist(
+                                ['Log Y', 'Log X'], 
+                                DEFAULT_VIEW['g2log'], 
+                                id='graph2-log',
+                                inline=True,
+                                inputStyle={'margin-right': '5px'},
+                                labelStyle={'margin-right': '10px'},
+                                style={'display': 'inline-block'}
+                            ),
+                            dcc.Checklist(
+                                ['Squash', 'Show Benchmarks'], 
+                                DEFAULT_VIEW['g2opts'], 
+                                id='graph2-opts',
+                                inline=True,
+                                inputStyle={'margin-right': '5px'},
+                                labelStyle={'margin-right': '10px'},
+                                style={'display': 'inline-block'}
+                            ),
+                        ],
                         md=6,
                         sm=7,
                         className='pt-2'
@@ -538,7 +611,11 @@ def serve_content(df, dd):
             ),
             html.Div(
                 id='graph2', 
-                children=dcc.Graph()
+                children=[
+                    dcc.Graph(id='graph2-fig'),
+                    dcc.Store(id='graph2-base'),
+                    html.Div(id='graph2-note')
+                ]
             ),
             html.Div(
                 className='mt-2',
@@ -566,7 +643,7 @@ def serve_content(df, dd):
                     dbc.Col(
                         dcc.Dropdown(
                             graph1_y_dropdown, 
-                            'Conductivity (MSm-1)', 
+                            DEFAULT_VIEW['g3y'], 
                             multi=False, 
                             placeholder='Pick Y-axis', 
                             id='graph3-yaxis-dropdown'
@@ -575,14 +652,27 @@ def serve_content(df, dd):
                         sm=6
                     ),
                     dbc.Col(
-                        dcc.Checklist(
-                            ['Log Y', 'Squash', 'Show Benchmarks'], 
-                            ['Log Y', 'Show Benchmarks'], 
-                            id='graph3-log',
-                            inline=True,
-                            inputStyle={'margin-right': '5px'},
-                            labelStyle={'margin-right': '10px'}
-                        ),
+                        [
+                            # log toggles are applied in the browser
+                            dcc.Checklist(
+                                ['Log Y'], 
+                                DEFAULT_VIEW['g3log'], 
+                                id='graph3-log',
+                                inline=True,
+                                inputStyle={'margin-right': '5px'},
+                                labelStyle={'margin-right': '10px'},
+                                style={'display': 'inline-block'}
+                            ),
+                            dcc.Checklist(
+                                ['Squash', 'Show Benchmarks'], 
+                                DEFAULT_VIEW['g3opts'], 
+                                id='graph3-opts',
+                                inline=True,
+                                inputStyle={'margin-right': '5px'},
+                                labelStyle={'margin-right': '10px'},
+                                style={'display': 'inline-block'}
+                            ),
+                        ],
                         md=6,
                         sm=7,
                         className='pt-2'
@@ -594,7 +684,10 @@ def serve_content(df, dd):
             dbc.Row([
                 dbc.Col(
                     id='graph3', 
-                    children=dcc.Graph()
+                    children=[
+                        dcc.Graph(id='graph3-fig'),
+                        dcc.Store(id='graph3-base')
+                    ]
                 )
             ]),
             
@@ -609,7 +702,7 @@ def serve_content(df, dd):
     )
     
     search_bar = dcc.Dropdown(
-        df['Reference'].unique(), 
+        df['Reference'].unique().tolist(), 
         [], 
         multi=True, 
         placeholder='Search papers', 
@@ -646,15 +739,31 @@ def serve_content(df, dd):
                 [
                     'Entire database - original', 
                     'Entire database - latest', 
-                    'Filtered data'
+                    'Filtered data',
+                    'Benchmark table'
                 ], 
                 [], 
                 multi=False, 
                 placeholder='Select data', 
                 id='download-dropdown'
             ),
+            dcc.Dropdown(
+                [
+                    {'label': 'CSV', 'value': 'csv'},
+                    {'label': 'CSV (gzip)', 'value': 'csv.gz'},
+                    {'label': 'Parquet', 'value': 'parquet'},
+                    {'label': 'Feather', 'value': 'feather'},
+                ], 
+                'csv', 
+                multi=False, 
+                clearable=False,
+                className='mt-2',
+                id='download-format'
+            ),
             dbc.Button('Download', id='download-button', className='mt-2'),
             dcc.Download(id="download-data"),
+            dcc.Store(id='download-url'),
+            html.Div(id='download-trigger', hidden=True),
         ],
         className='mt-3'
     )
@@ -687,19 +796,13 @@ def serve_content(df, dd):
 
 def serve_layout():
     
-    df = get_df()
-    dd = get_dd()
+    version = load_dataset()
+    df, dd = get_dataset(version)
     
-    # store the df in memory so callbacks don't need DB calls
-    store_df = dcc.Store(
-        id='df',
-        data=df.replace('NaN', np.nan).to_dict(),
-        storage_type='memory'
-    )
-
-    store_dd = dcc.Store(
-        id='dd',
-        data=dd,
+    # store only the dataset version; callbacks resolve it server-side
+    store_dataset = dcc.Store(
+        id='dataset',
+        data=version,
         storage_type='memory'
     )
     
@@ -714,10 +817,22 @@ def serve_layout():
         }
     )
     
+    client_filtering = []
+    if CLIENT_FILTERING:
+        client_filtering = [
+            dcc.Store(
+                id='client-columns',
+                data=dict(get_client_columns(df, dd, version), version=version)
+            ),
+            dcc.Store(id='filter-pending'),
+            dcc.Store(id='filter-commit'),
+            dcc.Interval(id='filter-debounce', interval=FILTER_DEBOUNCE_MS // 2),
+        ]
+    
     return dbc.Container(
         [
-            store_df,
-            store_dd,
+            store_dataset,
+            *client_filtering,
             navbar, 
             serve_sidebar(df),
             serve_content(df, dd),
@@ -780,15 +895,7 @@ def legend_buttons(n_clicks, n_clicks2, options, value):
         return [] if n_clicks %2 == 0 else options
     
     if ctx.triggered_id == 'legend-reset':
-        return [
-            c for c in CATEGORY_MAPPER.keys() 
-             if CATEGORY_MAPPER[c] != 'Other'
-            and c not in ['Single crystal graphite', 
-                             'Unaligned multiwall CNTs',
-                             'Unaligned Few-wall CNTs',
-                             'Conductive Polymer'
-                         ]
-        ]
+        return DEFAULT_LEGEND
 
 @dash.callback(
     [
@@ -803,8 +910,7 @@ def legend_buttons(n_clicks, n_clicks2, options, value):
         State({'type': 'filter-control', 'column': ALL}, 'value'),
         State({'type': 'filter-control', 'column': ALL}, 'id'),
         State({'type': 'filter-null', 'column': ALL}, 'value'),
-        State('df', 'data'),
-        State('dd', 'data')
+        State('dataset', 'data')
     ]
 )
 def display_filter_controls(
@@ -813,31 +919,36 @@ def display_filter_controls(
     ctrl_values,
     ctrl_idx,
     null_values,
-    df,
-    dd
+    version
 ):
         
     if ctx.triggered_id == 'reset-filters':
         return [], []
     
-    df = pd.DataFrame.from_dict(df)
+    profiles = get_column_profiles(resolve_version(version))
         
     res = [[], value]
     
-    existing_cols = set([i['column'] for i in ctrl_idx])
+    # previewing filters in the browser needs live slider values
+    updatemode = 'drag' if CLIENT_FILTERING else 'mouseup'
+    
+    # keep the state of controls that are already shown
+    existing = {
+        i['column']: (v, n)
+        for i, v, n in zip(ctrl_idx, ctrl_values, null_values)
+    }
         
-    for i,c in enumerate(value):
-        if c in existing_cols:
-            res[0].append(
-                generate_filter_control(
-                    c,
-                    df, dd,
-                    ctrl_values[i], 
-                    null_values[i]
-                )
+    for c in value:
+        ctrl_value, null_value = existing.get(c, (None, None))
+        res[0].append(
+            generate_filter_control(
+                c,
+                profiles[c],
+                ctrl_value, 
+                null_value,
+                updatemode=updatemode
             )
-        else:
-            res[0].append(generate_filter_control(c, df, dd))
+        )
         
     return res
 
@@ -870,118 +981,303 @@ def toggle_modal(n1, n2, is_open):
 
 def build_graphtable(df, x, y, squash):
     
-    if squash:
-        res_df = df[y].agg(['mean', 'max']).to_frame().T
-    else:
-        res_df = df.groupby(x)[y].agg(['mean', 'max']).reset_index()
-        
+    res_df = category_summary(df, x, y, squash)
     res_df = res_df.round(2)
         
     
-    return dash_table.DataTable(
+    return dict(
         data=res_df.to_dict('records'),
         columns=[{"name": i, "id": i} for i in res_df.columns]
     )
 
-def build_graph2table(df, x, y, squash):
+def build_graph2table(cube, x, y, squash):
     
-    records = list()
+    # todo: check this matches paper
+    cube = cube.pooled() if squash else cube
+    res_df = cube.pearson(x, y)
+    res_df = res_df[['r', 'p']].rename_axis('Category').reset_index()
+    res_df.columns = ['Category', 'Correlation', 'P-Value']
     
-    mask = df[x].notnull() & df[y].notnull()
-    # correlation requires non-null data
-    df = df[mask]
+    where_p_lt_05 = res_df['P-Value'] < 0.05
+    res_df = res_df.round(2)
+    # mixes numbers and strings, which a float column can't hold
+    res_df['P-Value'] = res_df['P-Value'].astype(object)
+    res_df.loc[where_p_lt_05, 'P-Value'] = '<0.05'
     
-    if not squash:
+    return dict(
+        data=res_df.to_dict('records'),
+        columns=[{"name": i, "id": i} for i in res_df.columns]
+    )
+
+
+# Inputs that only affect a single graph. Any other trigger
+# (legend, doping, filters, initial load) rebuilds every graph.
+GRAPH_TRIGGERS = {
+    'graph1-yaxis-dropdown': 'graph1',
+    'graph1-opts': 'graph1',
+    'graph2-xaxis-dropdown': 'graph2',
+    'graph2-yaxis-dropdown': 'graph2',
+    'graph2-opts': 'graph2',
+    'graph3-yaxis-dropdown': 'graph3',
+    'graph3-opts': 'graph3',
+}
+
+def get_graphs_to_update():
+    """
+    Return the set of graphs whose inputs triggered the current callback.
+    """
+    graphs = {
+        GRAPH_TRIGGERS.get(i) if isinstance(i, str) else None
+        for i in ctx.triggered_prop_ids.values()
+    }
     
-        for c in df['Category'].unique():            
-            m = df.Category == c
-            
-            if max(len(df[mask & m][x]), len(df[mask & m][y])) < 2:
-                continue
+    if not graphs or None in graphs:
+        return {'graph1', 'graph2', 'graph3'}
+    
+    return graphs
 
-            
+# Figures are rendered with linear axes; the log toggles
+# are applied by the `graphs.apply_log` clientside callback.
 
-            # todo: check this matches paper
-            r = stats.pearsonr(
-                np.log1p(df[mask & m][x]), 
-                np.log1p(df[mask & m][y])
-            )
-            r = list(r)
-            r.insert(0, c)
-            records.append(r)
-            
-    else:
-        
-        r = stats.pearsonr(
-            np.log1p(df[mask][x]), 
-            np.log1p(df[mask][y])
+def client_points(df, m=None):
+    """
+    In CLIENT_FILTERING mode, return the rows of `df` (or of `df[m]`)
+    to draw, indexed by row number, so the browser can hide filtered
+    points itself; otherwise None.
+    """
+    if not CLIENT_FILTERING:
+        return None
+    
+    points = df.reset_index(drop=True)
+    return points if m is None else points[m.to_numpy()]
+
+def render_graph1(df, mask, version, filter_key, g1y, g1opts):
+    
+    def build():
+        bm = None if 'Show Benchmarks' not in g1opts else compute_bm_g1(df, g1y, version)
+        return construct_fig1(
+            df[mask], 
+            'Category', 
+            g1y, 
+            False,
+            squash='Squash' in g1opts,
+            bm=bm,
+            points=client_points(df)
         )
-        r = list(r)
-        r.insert(0, 'All')
-        records.append(r)
-        
-        
-    res_df = pd.DataFrame(records, columns=['Category', 'Correlation', 'P-Value'])
     
-    where_p_lt_05 = res_df['P-Value'] < 0.05
-    res_df = res_df.round(2)
-    res_df.loc[where_p_lt_05, 'P-Value'] = '<0.05'
+    fig1 = cached_figure(
+        figure_key('graph1', filter_key, g1y, sorted(g1opts), CLIENT_FILTERING),
+        build
+    )
+    graph1table = cached_value(
+        figure_key('graph1table', filter_key, g1y, 'Squash' in g1opts),
+        lambda: build_graphtable(
+            df=df[mask],
+            x='Category',
+            y=g1y,
+            squash='Squash' in g1opts
+        )
+    )
     
-    return dash_table.DataTable(
-        data=res_df.to_dict('records'),
-        columns=[{"name": i, "id": i} for i in res_df.columns]
+    return [fig1, dash_table.DataTable(**graph1table)]
+
+def render_graph2(df, mask, version, filter_key, g2x, g2y, g2opts):
+    
+    def build():
+        bm = None if 'Show Benchmarks' not in g2opts else compute_bm_g2(df, g2x, g2y, version)
+        return construct_fig2(
+            df[mask], 
+            x=g2x, 
+            y=g2y,
+            logx=False,
+            logy=False,
+            squash='Squash' in g2opts,
+            bm=bm,
+            points=client_points(df)
+        )
+    
+    fig2 = cached_figure(
+        figure_key('graph2', filter_key, g2x, g2y, sorted(g2opts), CLIENT_FILTERING),
+        build
+    )
+    graph2table = cached_value(
+        figure_key('graph2table', filter_key, g2x, g2y, 'Squash' in g2opts),
+        lambda: build_graph2table(
+            cube=get_cube(df, mask, version, filter_key),
+            x=g2x,
+            y=g2y,
+            squash='Squash' in g2opts
+        )
+    )
+    
+    note = None
+    elided = fig2['layout'].get('meta', {}).get('elided', 0)
+    if elided:
+        note = html.Em(
+            f'{elided} overlapping points are hidden; '
+            'fit lines use every point.',
+            className='text-muted'
+        )
+    
+    return [fig2, note, dash_table.DataTable(**graph2table)]
+
+def render_graph3(df, mask, version, filter_key, g3y, g3opts):
+    
+    m = df.Category == 'Aligned Few-wall CNTs'
+    
+    def build():
+        bm = None if 'Show Benchmarks' not in g3opts else compute_bm_g1(df, g3y, version)
+        return construct_fig1(
+            df[mask & m],
+            'Production Process', 
+            g3y, 
+            False,
+            squash='Squash' in g3opts,
+            bm=bm,
+            points=client_points(df, m)
+        )
+    
+    fig3 = cached_figure(
+        figure_key('graph3', filter_key, g3y, sorted(g3opts), CLIENT_FILTERING),
+        build
+    )
+    graph3table = cached_value(
+        figure_key('graph3table', filter_key, g3y, 'Squash' in g3opts),
+        lambda: build_graphtable(
+            df=df[mask & m],
+            x='Production Process',
+            y=g3y,
+            squash='Squash' in g3opts
+        )
+    )
+    
+    return [fig3, dash_table.DataTable(**graph3table)]
+
+# Views requested so far, for pre-rendering the most popular ones.
+_view_counts = Counter()
+MAX_TRACKED_VIEWS = 1000
+
+def record_view(view):
+    _view_counts[json.dumps(view, sort_keys=True, default=str)] += 1
+    
+    if len(_view_counts) > MAX_TRACKED_VIEWS:
+        for k,_ in _view_counts.most_common()[MAX_TRACKED_VIEWS // 2:]:
+            del _view_counts[k]
+
+def get_default_view():
+    return dict(
+        DEFAULT_VIEW,
+        legend=DEFAULT_LEGEND,
+        dope=DEFAULT_DOPE,
+        apply_filters=True,
+        ctrl_values=[],
+        ctrl_idx=[],
+        null_values=[]
     )
 
+def render_view(df, dd, version, view):
+    """
+    Render (and so cache) every graph and table for a full view,
+    i.e. a dict of the `update_charts` inputs.
+    """
+    filters = [
+        view['legend'],
+        view['dope'],
+        df, dd,
+        view['ctrl_values'],
+        view['ctrl_idx'],
+        view['null_values'],
+        view['apply_filters']
+    ]
+    mask = get_filter_mask(*filters, version=version)
+    filter_key = filter_state_key(
+        version,
+        view['legend'],
+        view['dope'],
+        view['apply_filters'],
+        view['ctrl_values'],
+        view['ctrl_idx'],
+        view['null_values']
+    )
+    
+    render_graph1(df, mask, version, filter_key, view['g1y'], view['g1opts'])
+    render_graph2(df, mask, version, filter_key, view['g2x'], view['g2y'], view['g2opts'])
+    render_graph3(df, mask, version, filter_key, view['g3y'], view['g3opts'])
+
+@on_dataset_load
+def warm_views(df, dd, version):
+    """
+    Pre-render the default view, and the WARM_TOP_N most requested
+    views, whenever a dataset version is loaded.
+    """
+    render_view(df, dd, version, get_default_view())
+    
+    for k,_ in _view_counts.most_common(WARM_TOP_N):
+        try:
+            render_view(df, dd, version, json.loads(k))
+        except KeyError as e:
+            # a recorded view may name a column the new data lacks
+            print(f'Could not warm view, missing column {e}')
+
+
+# The filter state, in the order `update_charts` takes it.
+FILTER_DEPENDENCIES = [
+    ('legend', 'value'),
+    ('dope-control', 'value'),
+    ('filters-switch', 'on'),
+    ({'type': 'filter-control', 'column': ALL}, 'value'),
+    ({'type': 'filter-control', 'column': ALL}, 'id'),
+    ({'type': 'filter-null', 'column': ALL}, 'value'),
+]
 
 @dash.callback(
     [
-        Output('graph1', 'children'),
+        Output('graph1-base', 'data'),
         Output('graph1table', 'children'),
-        Output('graph2', 'children'),
+        Output('graph2-base', 'data'),
+        Output('graph2-note', 'children'),
         Output('graph2table', 'children'),
-        Output('graph3', 'children'),
+        Output('graph3-base', 'data'),
         Output('graph3table', 'children')
     ],
     # Input('update', 'n_clicks'),
     
     # Graph 1
     Input('graph1-yaxis-dropdown', 'value'), 
-    Input('graph1-log', 'value'),
+    Input('graph1-opts', 'value'),
     
     # Graph 2
     Input('graph2-xaxis-dropdown', 'value'), 
     Input('graph2-yaxis-dropdown', 'value'),
-    Input('graph2-log', 'value'),
+    Input('graph2-opts', 'value'),
     
     Input('graph3-yaxis-dropdown', 'value'),
-    Input('graph3-log', 'value'),
+    Input('graph3-opts', 'value'),
     
-    # Common
-    Input('legend', 'value'), 
-    Input('dope-control', 'value'),
-    Input('filters-switch', 'on'),
-    Input({'type': 'filter-control', 'column': ALL}, 'value'),
-    Input({'type': 'filter-control', 'column': ALL}, 'id'),
-    Input({'type': 'filter-null', 'column': ALL}, 'value'),
+    # Common; previewed in the browser until committed
+    *[
+        (State if CLIENT_FILTERING else Input)(*d) 
+        for d in FILTER_DEPENDENCIES
+    ],
     
     # Data
-    State('df', 'data'),
-    State('dd', 'data')
+    State('dataset', 'data'),
+    *([Input('filter-commit', 'data')] if CLIENT_FILTERING else [])
 )
 def update_charts(
     # n_clicks,
     
     # G1
     g1y, 
-    g1log,
+    g1opts,
     
     # G2
     g2x,
     g2y,
-    g2log,
+    g2opts,
     
     g3y,
-    g3log,
+    g3opts,
     
     # Common
     legend, 
@@ -992,12 +1288,13 @@ def update_charts(
     null_values,
     
     # Data
-    df,
-    dd
+    version,
+    commit=None
 
 ):
         
-    df = pd.DataFrame.from_dict(df)
+    version = resolve_version(version)
+    df, dd = get_dataset(version)
 
     print('Got df')
     
@@ -1008,74 +1305,84 @@ def update_charts(
         ctrl_values, 
         ctrl_idx, 
         null_values,
-        apply_filters
+        apply_filters,
+        version=version
     )
 
     print('got mask')
     
-    bm = None if 'Show Benchmarks' not in g1log else compute_bm_g1(df, g1y)
-    print('got bm')
-    fig1 = construct_fig1(
-        df[mask], 
-        'Category', 
-        g1y, 
-        'Log Y' in g1log,
-        squash='Squash' in g1log,
-        bm=bm
-    )
-
-    print('got fig1')
-
-    bm = None if 'Show Benchmarks' not in g2log else compute_bm_g2(df, g2x, g2y)
-    fig2 = construct_fig2(
-        df[mask], 
-        x=g2x, 
-        y=g2y,
-        logx='Log X' in g2log,
-        logy='Log Y' in g2log,
-        squash='Squash' in g2log,
-        bm=bm
-    )
+    record_view(dict(
+        g1y=g1y, g1opts=g1opts,
+        g2x=g2x, g2y=g2y, g2opts=g2opts,
+        g3y=g3y, g3opts=g3opts,
+        legend=legend,
+        dope=dope,
+        apply_filters=apply_filters,
+        ctrl_values=ctrl_values,
+        ctrl_idx=ctrl_idx,
+        null_values=null_values
+    ))
     
-    graph1table = build_graphtable(
-        df=df[mask],
-        x='Category',
-        y=g1y,
-        squash='Squash' in g1log
+    filter_key = filter_state_key(
+        version,
+        legend, 
+        dope, 
+        apply_filters,
+        ctrl_values, 
+        ctrl_idx, 
+        null_values
     )
     
-    graph2table = build_graph2table(
-        df=df[mask],
-        x=g2x,
-        y=g2y,
-        squash='Squash' in g2log
-    )
+    graphs = get_graphs_to_update()
+    res = [no_update]*7
     
-    bm = None if 'Show Benchmarks' not in g3log else compute_bm_g1(df, g3y)
-    m = df.Category == 'Aligned Few-wall CNTs'
-    fig3 = construct_fig1(
-        df[mask & m],
-        'Production Process', 
-        g3y, 
-        'Log Y' in g3log,
-        squash='Squash' in g3log,
-        bm=bm
+    if 'graph1' in graphs:
+        res[0:2] = render_graph1(df, mask, version, filter_key, g1y, g1opts)
+        print('got graph1')
+    
+    if 'graph2' in graphs:
+        res[2:5] = render_graph2(df, mask, version, filter_key, g2x, g2y, g2opts)
+        print('got graph2')
+    
+    if 'graph3' in graphs:
+        res[5:7] = render_graph3(df, mask, version, filter_key, g3y, g3opts)
+        print('got graph3')
+            
+    return res
+
+for n in (1, 2, 3):
+    if CLIENT_FILTERING:
+        dash.clientside_callback(
+            ClientsideFunction(namespace='graphs', function_name='apply_filters'),
+            Output(f'graph{n}-fig', 'figure'),
+            Input(f'graph{n}-base', 'data'),
+            Input(f'graph{n}-log', 'value'),
+            *[Input(*d) for d in FILTER_DEPENDENCIES],
+            State(f'graph{n}-log', 'options'),
+            State('client-columns', 'data'),
+        )
+    else:
+        dash.clientside_callback(
+            ClientsideFunction(namespace='graphs', function_name='apply_log'),
+            Output(f'graph{n}-fig', 'figure'),
+            Input(f'graph{n}-base', 'data'),
+            Input(f'graph{n}-log', 'value'),
+            State(f'graph{n}-log', 'options'),
+        )
+
+if CLIENT_FILTERING:
+    dash.clientside_callback(
+        ClientsideFunction(namespace='filters', function_name='pending'),
+        Output('filter-pending', 'data'),
+        *[Input(*d) for d in FILTER_DEPENDENCIES],
     )
-    graph3table = build_graphtable(
-        df=df[mask & m],
-        x='Production Process',
-        y=g3y,
-        squash='Squash' in g3log
+    dash.clientside_callback(
+        ClientsideFunction(namespace='filters', function_name='commit'),
+        Output('filter-commit', 'data'),
+        Input('filter-debounce', 'n_intervals'),
+        State('filter-pending', 'data'),
+        State('filter-debounce', 'interval'),
     )
-            
-    return [
-        dcc.Graph(figure=fig1),
-        graph1table,
-        dcc.Graph(figure=fig2),
-        graph2table,
-        dcc.Graph(figure=fig3),
-        graph3table
-    ]
 
 @dash.callback(
     [
@@ -1092,7 +1399,10 @@ def toggle_filter_controls(apply_filters):
         return [True]*3
     
 @dash.callback(
-    Output("download-data", "data"),
+    [
+        Output("download-data", "data"),
+        Output("download-url", "data"),
+    ],
     Input("download-button", "n_clicks"),
     State('legend', 'value'), 
     State('dope-control', 'value'),
@@ -1100,9 +1410,9 @@ def toggle_filter_controls(apply_filters):
     State({'type': 'filter-control', 'column': ALL}, 'value'),
     State({'type': 'filter-control', 'column': ALL}, 'id'),
     State({'type': 'filter-null', 'column': ALL}, 'value'),
-    State('df', 'data'),
-    State('dd', 'data'),
+    State('dataset', 'data'),
     State('download-dropdown', 'value'),
+    State('download-format', 'value'),
     prevent_initial_call=True,
 )
 def func(
@@ -1113,32 +1423,72 @@ def func(
     ctrl_values,
     ctrl_idx,
     null_values,
-    df, 
-    dd,
-    dl_type
+    version,
+    dl_type,
+    fmt
 ):
-    df = pd.DataFrame.from_dict(df)
+    version = resolve_version(version)
     
+    # datasets are streamed by the download route; the callback
+    # only hands out a signed URL for it
     if dl_type == 'Filtered data':
-    
-        mask = get_filter_mask(
-            legend, 
-            dope, 
-            df, dd,
-            ctrl_values, 
-            ctrl_idx, 
-            null_values,
-            apply_filters
+        filters = dict(
+            legend=legend,
+            dope=dope,
+            ctrl_values=ctrl_values,
+            ctrl_idx=ctrl_idx,
+            null_values=null_values,
+            apply_filters=apply_filters
         )
-
-        ts = int(time.time())
-        return dcc.send_data_frame(df[mask].to_csv, f"database_filtered_{ts}.csv")
+        # only exports of the default state are worth keeping on disk
+        default = get_default_view()
+        cache = filter_state_key(
+            version, legend, dope, apply_filters,
+            ctrl_values, ctrl_idx, null_values
+        ) == filter_state_key(
+            version, default['legend'], default['dope'], default['apply_filters'],
+            default['ctrl_values'], default['ctrl_idx'], default['null_values']
+        )
+        url = sign_download('filtered', version, filters, fmt, cache)
+        return no_update, dash.get_relative_path(url)
     
     elif dl_type == 'Entire database - original':
-        df = get_df_for_download('original')
-        ts = int(time.time())
-        return dcc.send_data_frame(df.to_csv, f"database_original_{ts}.csv")
+        url = sign_download('original', version, fmt=fmt)
+        return no_update, dash.get_relative_path(url)
 
     elif dl_type == 'Entire database - latest':
+        url = sign_download('latest', version, fmt=fmt)
+        return no_update, dash.get_relative_path(url)
+
+    elif dl_type == 'Benchmark table':
+        df, dd = get_dataset(version)
+        table = get_benchmark_table(df, dd, version)
+        table = table.rename_axis('Benchmark')
+        if fmt not in ('csv', 'csv.gz'):
+            # Arrow formats leave out the index
+            table = table.reset_index()
+        
         ts = int(time.time())
-        return dcc.send_data_frame(df.to_csv, f"database_latest_{ts}.csv")
+        _, ext = EXPORT_FORMATS[fmt]
+        
+        # the table is small, so it is sent inline in the chosen format
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, f"benchmarks_{ts}{ext}")
+            write_export(table, None, fmt, path)
+            return dcc.send_file(path), no_update
+    
+    return no_update, no_update
+
+dash.clientside_callback(
+    """
+    function(url) {
+        if (url) {
+            window.location.assign(url);
+        }
+        return window.dash_clientside.no_update;
+    }
+    """,
+    Output('download-trigger', 'children'),
+    Input('download-url', 'data'),
+    prevent_initial_call=True,
+)
@@ -0,0 +1,319 @@
+import pandas as pd
+import numpy as np
+import scipy.stats as stats
+
+
+def _group_codes(df, by):
+    if by is None:
+        return np.zeros(len(df), dtype=np.intp), pd.Index(['All'])
+
+    codes, groups = pd.factorize(df[by])
+    return codes, pd.Index(groups)
+
+
+def _grouped_moments(codes, k, a, b):
+    # per-group count, means of `a` and `b`, and their centered second
+    # moments; centering first avoids cancellation
+    n = np.bincount(codes, minlength=k)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ma = np.bincount(codes, a, k) / n
+        mb = np.bincount(codes, b, k) / n
+
+    da = a - ma[codes]
+    db = b - mb[codes]
+    saa = np.bincount(codes, da*da, k)
+    sbb = np.bincount(codes, db*db, k)
+    sab = np.bincount(codes, da*db, k)
+
+    return n, ma, mb, saa, sbb, sab
+
+
+def grouped_loglog_fit(df, x, y, by='Category'):
+    """
+    Fit log10(y) = slope * log10(x) + intercept for every group of `by`
+    (or for all rows if `by` is None) in one vectorized pass.
+
+    Rows with a null or non-positive `x` or `y` are left out, since
+    they have no logarithm. Returns a DataFrame indexed by group,
+    in order of first appearance, with columns `slope`, `intercept`,
+    `r2`, `n`, `x_min` and `x_max`. Groups with fewer than two distinct
+    `x` values get a NaN slope.
+    """
+    valid = (df[x] > 0) & (df[y] > 0)
+    if by is not None:
+        valid &= df[by].notnull()
+    d = df.loc[valid]
+
+    codes, groups = _group_codes(d, by)
+    k = len(groups)
+
+    lx = np.log10(d[x].to_numpy(dtype=float))
+    ly = np.log10(d[y].to_numpy(dtype=float))
+
+    n, mx, my, sxx, syy, sxy = _grouped_moments(codes, k, lx, ly)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = np.where(sxx > 0, sxy / sxx, np.nan)
+        intercept = my - slope*mx
+        r2 = sxy**2 / (sxx*syy)
+
+    xs = d[x].to_numpy(dtype=float)
+    x_min = np.full(k, np.inf)
+    x_max = np.full(k, -np.inf)
+    np.minimum.at(x_min, codes, xs)
+    np.maximum.at(x_max, codes, xs)
+
+    return pd.DataFrame(
+        {
+            'slope': slope,
+            'intercept': intercept,
+            'r2': r2,
+            'n': n,
+            'x_min': x_min,
+            'x_max': x_max
+        },
+        index=groups
+    )
+
+
+def category_summary(df, x, y, squash=False):
+    """
+    Mean and max of `y` for every value of `x`, or over all rows
+    if `squash`.
+    """
+    if squash:
+        return df[y].agg(['mean', 'max']).to_frame().T
+
+    return df.groupby(x, observed=True)[y].agg(['mean', 'max']).reset_index()
+
+
+def _grouped_r(codes, k, a, b):
+    # per-group count and Pearson r of `a` and `b`
+    n, _, _, saa, sbb, sab = _grouped_moments(codes, k, a, b)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.clip(sab / np.sqrt(saa*sbb), -1, 1)
+
+    return n, r
+
+
+def _r_pvalue(r, n):
+    # two-sided p-value of r under the t distribution with n - 2 dof,
+    # as scipy.stats.pearsonr; two points always give p = 1
+    dof = n - 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = r * np.sqrt(dof / ((1 - r)*(1 + r)))
+        p = 2*stats.t.sf(np.abs(t), np.maximum(dof, 1))
+
+    return np.where(dof > 0, p, 1.0)
+
+
+def grouped_pearson(df, x, y, by='Category', spearman=False, ci=None):
+    """
+    Pearson correlation of log1p(x) and log1p(y) for every group of `by`
+    (or for all rows if `by` is None), over rows where both are non-null,
+    in one vectorized pass.
+
+    Returns a DataFrame indexed by group, in order of first appearance,
+    with columns `r`, `p` and `n`. Groups with fewer than two rows
+    are left out.
+
+    With `spearman`, adds the rank correlation `rho` and its p-value
+    `rho_p`. With a confidence level `ci` (e.g. 0.95), adds Fisher-z
+    bounds `r_low` and `r_high` on `r` (NaN for groups of three or fewer).
+    """
+    valid = df[x].notnull() & df[y].notnull()
+    if by is not None:
+        valid &= df[by].notnull()
+    d = df.loc[valid]
+
+    codes, groups = _group_codes(d, by)
+    k = len(groups)
+
+    lx = np.log1p(d[x].to_numpy(dtype=float))
+    ly = np.log1p(d[y].to_numpy(dtype=float))
+
+    n, r = _grouped_r(codes, k, lx, ly)
+    res = pd.DataFrame({'r': r, 'p': _r_pvalue(r, n), 'n': n}, index=groups)
+
+    if spearman:
+        # log1p is monotonic, so ranking the logs ranks the raw values
+        ranks = pd.DataFrame({'x': lx, 'y': ly}).groupby(codes).rank()
+        _, rho = _grouped_r(
+            codes, k, ranks['x'].to_numpy(), ranks['y'].to_numpy()
+        )
+        res['rho'] = rho
+        res['rho_p'] = _r_pvalue(rho, n)
+
+    if ci is not None:
+        zc = stats.norm.ppf((1 + ci) / 2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = np.arctanh(r)
+            se = np.where(n > 3, 1 / np.sqrt(n - 3), np.nan)
+        res['r_low'] = np.tanh(z - zc*se)
+        res['r_high'] = np.tanh(z + zc*se)
+
+    return res[res['n'] >= 2]
+
+
+class CoMomentCube:
+    """
+    Pairwise-complete sufficient statistics of transformed numeric
+    columns, per group. For group `g` and columns `i`, `j`, over the
+    rows where both are non-null:
+
+        n[g, i, j]     row count
+        mean[g, i, j]  mean of column i
+        cxx[g, i, j]   sum of squared deviations of column i
+        cxy[g, i, j]   sum of cross deviations of columns i and j
+
+    Any pair of columns can then be answered without the data.
+    """
+
+    def __init__(self, groups, cols, n, mean, cxx, cxy):
+        self.groups = groups
+        self.cols = pd.Index(cols)
+        self.n = n
+        self.mean = mean
+        self.cxx = cxx
+        self.cxy = cxy
+
+    def _pair(self, x, y):
+        # drop the trailing null group, if any
+        k = len(self.groups)
+        i, j = self.cols.get_loc(x), self.cols.get_loc(y)
+        return (
+            self.n[:k, i, j],
+            self.mean[:k, i, j], self.mean[:k, j, i],
+            self.cxx[:k, i, j], self.cxx[:k, j, i],
+            self.cxy[:k, i, j]
+        )
+
+    def pooled(self):
+        """
+        Combine every group (including rows with a null group)
+        into a single group, 'All'.
+        """
+        n = self.n.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.nansum(self.n*self.mean, axis=0) / n
+            d = np.nan_to_num(self.mean - mean)
+
+        cxx = np.nansum(self.cxx, axis=0) + (self.n*d*d).sum(axis=0)
+        cxy = np.nansum(self.cxy, axis=0) \
+            + (self.n*d*d.transpose(0, 2, 1)).sum(axis=0)
+
+        return CoMomentCube(
+            pd.Index(['All']), self.cols,
+            n[None], mean[None], cxx[None], cxy[None]
+        )
+
+    def pearson(self, x, y):
+        """
+        Same result as `grouped_pearson` (without its options).
+        """
+        n, _, _, sxx, syy, sxy = self._pair(x, y)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r = np.clip(sxy / np.sqrt(sxx*syy), -1, 1)
+
+        res = pd.DataFrame(
+            {'r': r, 'p': _r_pvalue(r, n), 'n': n},
+            index=self.groups
+        )
+        return res[res['n'] >= 2]
+
+    def fit(self, x, y):
+        """
+        Least-squares fit of y on x in the transformed space, per group,
+        with columns `slope`, `intercept`, `r2` and `n`.
+        """
+        n, mx, my, sxx, syy, sxy = self._pair(x, y)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            slope = np.where(sxx > 0, sxy / sxx, np.nan)
+            intercept = my - slope*mx
+            r2 = sxy**2 / (sxx*syy)
+
+        res = pd.DataFrame(
+            {'slope': slope, 'intercept': intercept, 'r2': r2, 'n': n},
+            index=self.groups
+        )
+        return res[res['n'] > 0]
+
+
+def comoment_cube(df, cols, by='Category', transform='log1p'):
+    """
+    Build a `CoMomentCube` of `cols` for every group of `by`
+    (or for all rows if `by` is None).
+
+    `transform` is 'log1p' (as `grouped_pearson`) or 'log10', where
+    non-positive values count as missing (as `grouped_loglog_fit`).
+    """
+    values = df[list(cols)].to_numpy(dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if transform == 'log10':
+            values = np.log10(np.where(values > 0, values, np.nan))
+        else:
+            values = np.log1p(values)
+
+    codes, groups = _group_codes(df, by)
+    # rows with a null group go to an extra, unlabelled group
+    codes = np.where(codes < 0, len(groups), codes)
+    k = len(groups) + int((codes == len(groups)).any())
+    p = len(cols)
+
+    n, mean, cxx, cxy = (np.full((k, p, p), np.nan) for _ in range(4))
+
+    for g in range(k):
+        v = values[codes == g]
+        valid = ~np.isnan(v)
+        w = valid.astype(float)
+
+        # center each column first to avoid cancellation
+        count = w.sum(axis=0)
+        center = np.where(valid, v, 0).sum(axis=0) / np.maximum(count, 1)
+        vc = np.where(valid, v - center, 0)
+
+        # column sums restricted to the rows where the other is valid
+        ng = w.T @ w
+        s = vc.T @ w
+        with np.errstate(invalid='ignore', divide='ignore'):
+            m = s / ng
+
+        n[g] = ng
+        mean[g] = m + center[:, None]
+        cxx[g] = (vc*vc).T @ w - s*m
+        cxy[g] = vc.T @ vc - s*m.T
+
+    return CoMomentCube(groups, cols, n.astype(int), mean, cxx, cxy)
+
+
+def verify_downcast(original, downcast, cols, rtol=1e-4):
+    """
+    Check that the per-category log-log fits and Pearson correlations
+    of every pair of `cols` agree between the `original` and `downcast`
+    frames within `rtol`.
+
+    Returns the list of `(x, y)` pairs that do not.
+    """
+    failed = []
+
+    for x in cols:
+        for y in cols:
+            unchanged = all(
+                original[c].dtype == downcast[c].dtype for c in (x, y)
+            )
+            if x == y or unchanged:
+                continue
+
+            for stat in (grouped_loglog_fit, grouped_pearson):
+                a = stat(original, x, y)
+                b = stat(downcast, x, y)
+                if not (
+                    a.index.equals(b.index)
+                    and np.allclose(
+                        a.to_numpy(dtype=float), b.to_numpy(dtype=float),
+                        rtol=rtol, atol=1e-12, equal_nan=True
+                    )
+                ):
+                    failed.append((x, y))
+                    break
+
+    return failed
@@ -0,0 +1,238 @@
+from flask import Blueprint, jsonify, request
+import pandas as pd
+import json
+
+from .db import load_dataset, resolve_version, get_dataset
+from .filters import get_filter_mask, filter_state_key, CATEGORY_COL, DOPE_COL
+from .analytics import category_summary
+from .correlations import get_cube
+
+# Largest page a client may request.
+MAX_PAGE_SIZE = 1000
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _get_spec():
+    spec = request.get_json(force=True, silent=True)
+    if not isinstance(spec, dict):
+        raise QueryError('Request body must be a JSON object')
+    return spec
+
+
+def _get_int(spec, key, default):
+    try:
+        return int(spec.get(key, default))
+    except (TypeError, ValueError):
+        raise QueryError(f'{key} must be an integer')
+
+
+def _get_bool(spec, key, default):
+    value = spec.get(key, default)
+    if not isinstance(value, bool):
+        raise QueryError(f'{key} must be true or false')
+    return value
+
+
+def _get_list(spec, key):
+    value = spec.get(key)
+    if value is not None and not isinstance(value, list):
+        raise QueryError(f'{key} must be a list')
+    return value
+
+
+def _get_values(spec, key):
+    # values compared against column values must be scalars
+    values = _get_list(spec, key)
+    if values is not None and not all(
+        v is None or isinstance(v, (str, int, float, bool)) for v in values
+    ):
+        raise QueryError(f'{key} must only hold strings, numbers or null')
+    return values
+
+
+def _is_number(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def _all_values(df, c):
+    # every category, and null
+    return df[c].cat.categories.tolist() + [None]
+
+
+def parse_filters(spec, df, dd):
+    """
+    Translate a query spec into `get_filter_mask` arguments.
+
+    The spec mirrors the dashboard controls:
+
+        {
+            "legend": [...],            # categories, default all
+            "dope": ["Yes", "No"],      # default all
+            "filters": {
+                "<numeric column>": {"range": [lo, hi], "include_null": true},
+                "<other column>": {"values": [...], "include_null": true}
+            }
+        }
+    """
+    # an empty list selects nothing, as in the dashboard
+    legend = _get_values(spec, 'legend')
+    if legend is None:
+        legend = _all_values(df, CATEGORY_COL)
+    dope = _get_values(spec, 'dope')
+    if dope is None:
+        dope = _all_values(df, DOPE_COL)
+    filters = spec.get('filters') or {}
+    if not isinstance(filters, dict):
+        raise QueryError('filters must be an object keyed by column')
+
+    ctrl_values, ctrl_idx, null_values = [], [], []
+
+    for c, f in filters.items():
+        if c not in dd:
+            raise QueryError(f'Unknown column: {c}')
+        if not isinstance(f, dict):
+            raise QueryError(f'The filter on {c} must be an object')
+
+        if dd[c] == 'numeric':
+            rng = f.get('range')
+            if not (
+                isinstance(rng, list) and len(rng) == 2
+                and all(_is_number(v) for v in rng)
+            ):
+                raise QueryError(f'{c} needs a [min, max] range')
+            ctrl_values.append(rng)
+        else:
+            values = _get_values(f, 'values')
+            if values is None:
+                raise QueryError(f'{c} needs a list of values')
+            ctrl_values.append(values)
+
+        include_null = _get_bool(f, 'include_null', True)
+        ctrl_idx.append({'type': 'filter-control', 'column': c})
+        null_values.append(['Include null'] if include_null else [])
+
+    return legend, dope, ctrl_values, ctrl_idx, null_values, bool(filters)
+
+
+def _filtered(spec):
+    version = spec.get('version') or load_dataset()
+    if not isinstance(version, str):
+        raise QueryError('version must be a string')
+    version = resolve_version(version)
+    df, dd = get_dataset(version)
+
+    legend, dope, ctrl_values, ctrl_idx, null_values, apply_filters = \
+        parse_filters(spec, df, dd)
+
+    mask = get_filter_mask(
+        legend, 
+        dope, 
+        df, dd,
+        ctrl_values, 
+        ctrl_idx, 
+        null_values,
+        apply_filters,
+        version=version
+    )
+    filter_key = filter_state_key(
+        version,
+        legend, 
+        dope, 
+        apply_filters,
+        ctrl_values, 
+        ctrl_idx, 
+        null_values
+    )
+
+    return version, df, mask, filter_key
+
+
+def _check_columns(df, columns):
+    missing = [c for c in columns if not isinstance(c, str) or c not in df]
+    if missing:
+        raise QueryError(f'Unknown columns: {missing}')
+
+
+@api.errorhandler(QueryError)
+def query_error(e):
+    return jsonify(error=str(e)), 400
+
+
+@api.route('/query', methods=['POST'])
+def query():
+    """
+    Return one page of the rows matching a filter spec (see
+    `parse_filters`), optionally projected to `columns`.
+    """
+    spec = _get_spec()
+    version, df, mask, filter_key = _filtered(spec)
+
+    columns = _get_list(spec, 'columns') or list(df.columns)
+    _check_columns(df, columns)
+
+    page = _get_int(spec, 'page', 1)
+    page_size = min(_get_int(spec, 'page_size', 100), MAX_PAGE_SIZE)
+    if page < 1 or page_size < 1:
+        raise QueryError('page and page_size must be positive')
+
+    rows = mask.to_numpy().nonzero()[0]
+    start = (page - 1)*page_size
+    chunk = df.iloc[rows[start:start + page_size]][columns]
+
+    return jsonify(
+        version=version,
+        total=len(rows),
+        page=page,
+        page_size=page_size,
+        rows=json.loads(chunk.to_json(orient='records'))
+    )
+
+
+@api.route('/aggregate', methods=['POST'])
+def aggregate():
+    """
+    Return the dashboard's table aggregates for the rows matching a
+    filter spec: `"table": "graphtable"` (mean/max of `y` per `x`),
+    `"table": "graph2table"` (per-category log correlation of `x` and `y`)
+    or `"table": "graph2fits"` (per-category log-log fit of `y` on `x`).
+    """
+    spec = _get_spec()
+    version, df, mask, filter_key = _filtered(spec)
+
+    table = spec.get('table')
+    if table not in ('graphtable', 'graph2table', 'graph2fits'):
+        raise QueryError(
+            'table must be "graphtable", "graph2table" or "graph2fits"'
+        )
+
+    x, y = spec.get('x'), spec.get('y')
+    if table == 'graphtable':
+        x = x or CATEGORY_COL
+    if not (isinstance(x, str) and isinstance(y, str)):
+        raise QueryError(f'{table} needs column names x and y')
+    _check_columns(df, [x, y])
+    squash = _get_bool(spec, 'squash', False)
+
+    if table == 'graphtable':
+        if not pd.api.types.is_numeric_dtype(df[y]):
+            raise QueryError('graphtable needs a numeric y')
+        res = category_summary(df[mask], x, y, squash)
+    else:
+        transform = 'log1p' if table == 'graph2table' else 'log10'
+        cube = get_cube(df, mask, version, filter_key, transform)
+        if x not in cube.cols or y not in cube.cols:
+            raise QueryError(f'{table} needs numeric x and y')
+
+        cube = cube.pooled() if squash else cube
+        res = cube.pearson(x, y) if table == 'graph2table' else cube.fit(x, y)
+        res = res.rename_axis('Category').reset_index()
+
+    return jsonify(
+        version=version,
+        rows=json.loads(res.to_json(orient='records'))
+    )
@@ -1,63 +1,111 @@
+import pandas as pd
+import numpy as np
+
+from .db import memoize_by_version, on_dataset_load
+
 BENCHMARK_COLORS = {
         'Copper': '#B87333',
         'Iron': '#a19d94',
         'Steel': 'white',
-        'SCG': 'black'
+        'SCG': 'black',
+        'Aluminum': '#848789'
     }
 
-def compute_bm_g1(df, y):
-    res = {
-        'Copper': None,
-        'Iron': None,
-        'SCG': None,
-        'Steel': None
-    }
+# How rows are assigned to benchmarks from their `Notes`:
+# (kind, pattern), where kind is 'exact' or 'contains' (case-insensitive).
+BENCHMARK_NOTES = {
+    'Copper': ('exact', 'Copper'),
+    'Iron': ('exact', 'Iron'),
+    'SCG': ('exact', 'Single Crystal Graphite'),
+    'Steel': ('contains', 'steel'),
+    'Aluminum': ('exact', 'Aluminum'),
+}
+
+
+def classify_notes(notes):
+    """
+    Map each distinct value of `notes` to its benchmark (or None)
+    and return the per-row benchmark as a Categorical.
+
+    Patterns are only matched against the distinct values; rows are
+    then mapped through their codes.
+    """
+    if isinstance(notes.dtype, pd.CategoricalDtype):
+        codes, uniques = notes.cat.codes.to_numpy(), notes.cat.categories
+    else:
+        codes, uniques = pd.factorize(notes)
+
+    values = pd.Series(uniques, dtype=object)
+    labels = np.full(len(values) + 1, -1)
+
+    for i, (bm, (kind, pattern)) in enumerate(BENCHMARK_NOTES.items()):
+        if kind == 'exact':
+            m = values == pattern
+        else:
+            m = values.astype(str).str.contains(pattern, case=False, regex=False)
+        labels[:-1][m.to_numpy() & (labels[:-1] == -1)] = i
+
+    # code -1 (null) picks the trailing -1
+    return pd.Categorical.from_codes(
+        labels[codes],
+        categories=list(BENCHMARK_NOTES)
+    )
+
+
+@memoize_by_version
+def get_benchmark_groups(df, dd):
+    return classify_notes(df['Notes'])
+
+
+def compute_benchmarks(df, cols):
+    """
+    Return the mean of each column in `cols` for every benchmark,
+    as a DataFrame indexed by benchmark name.
+    """
+    groups = classify_notes(df['Notes'])
+    # e.g. x == y on graph 2; duplicate columns break `.at` lookups
+    cols = list(dict.fromkeys(cols))
+
+    return df[cols].groupby(groups, observed=False).mean() \
+        .reindex(list(BENCHMARK_NOTES))
+
+
+@memoize_by_version
+def get_benchmark_table(df, dd):
+    """
+    Return the (benchmark x numeric column) table of means
+    for the unfiltered dataset.
+    """
+    groups = get_benchmark_groups(df, dd)
+    cols = df.select_dtypes('number').columns
+
+    return df[cols].groupby(groups, observed=False).mean() \
+        .reindex(list(BENCHMARK_NOTES))
+
+
+@on_dataset_load
+def _precompute_benchmarks(df, dd, version):
+    get_benchmark_table(df, dd, version)
+
+
+def _lookup(df, cols, version):
+    # `df` must be the unfiltered dataset when `version` is given
+    if version is not None:
+        table = get_benchmark_table(df, None, version)
+        if all(c in table for c in cols):
+            return table
+
+    return compute_benchmarks(df, cols)
+
+
+def compute_bm_g1(df, y, version=None):
+    means = _lookup(df, [y], version)
+    return means[y].to_dict()
 
 
-    res['Copper'] = df.loc[df.Notes == 'Copper', y].mean()
-    print('got copper')
-    res['Iron'] = df.loc[df.Notes == 'Iron', y].mean()
-    print('got iron')
-    mask = df.Notes == 'Single Crystal Graphite'
-    print('got mask')
-    print(df.loc[mask, y].tolist())
-    res['SCG'] = df.loc[mask, y].mean()
-    print('got scg')
-    
-    mask = df.Notes.fillna('').str.contains('steel', case=False)
-    print('got mask again')
-    res['Steel'] = df.loc[mask, y].mean()
-    print('got steel')
-    
-    return res
-
-def compute_bm_g2(df, x, y):
-    # todo: add aluminum for both benchmarks
-    res = {
-        'Copper': [],
-        'Iron': [],
-        'SCG': [],
-        'Steel': [],
+def compute_bm_g2(df, x, y, version=None):
+    means = _lookup(df, [x, y], version)
+    return {
+        bm: [means.at[bm, x], means.at[bm, y]]
+        for bm in means.index
     }
-    
-    # Compute X
-    res['Copper'].append(df.loc[df.Notes == 'Copper', x].mean())
-    res['Iron'].append(df.loc[df.Notes == 'Iron', x].mean())
-    
-    mask = df.Notes == 'Single Crystal Graphite'
-    res['SCG'].append(df.loc[mask, x].mean())
-    
-    mask = df.Notes.fillna('').str.contains('steel', case=False)
-    res['Steel'].append(df.loc[mask, x].mean())
-    
-    # Compute Y
-    res['Copper'].append(df.loc[df.Notes == 'Copper', y].mean())
-    res['Iron'].append(df.loc[df.Notes == 'Iron', y].mean())
-    
-    mask = df.Notes == 'Single Crystal Graphite'
-    res['SCG'].append(df.loc[mask, y].mean())
-    
-    mask = df.Notes.fillna('').str.contains('steel', case=False)
-    res['Steel'].append(df.loc[mask, y].mean())
-    
-    return res
\ No newline at end of file
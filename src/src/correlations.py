@@ -0,0 +1,72 @@
+from collections import OrderedDict
+import threading
+import os
+
+from .db import memoize_by_version, on_dataset_load
+from .analytics import comoment_cube
+from .filters import CATEGORY_COL
+
+# Number of filtered co-moment cubes kept per worker.
+CUBE_CACHE_ENTRIES = int(os.environ.get('CUBE_CACHE_ENTRIES', 32))
+
+_cube_cache = OrderedDict()
+_cube_cache_lock = threading.Lock()
+
+
+def _build_cube(df, transform):
+    return comoment_cube(
+        df,
+        df.select_dtypes('number').columns,
+        by=CATEGORY_COL,
+        transform=transform
+    )
+
+
+@memoize_by_version
+def get_correlation_cube(df, dd):
+    """
+    Return the log1p co-moment cube of every numeric column
+    of the unfiltered dataset, for correlations.
+    """
+    return _build_cube(df, 'log1p')
+
+
+@memoize_by_version
+def get_fit_cube(df, dd):
+    """
+    Return the log10 co-moment cube of every numeric column
+    of the unfiltered dataset, for log-log fits.
+    """
+    return _build_cube(df, 'log10')
+
+
+@on_dataset_load
+def _precompute_cubes(df, dd, version):
+    get_correlation_cube(df, dd, version)
+
+
+def get_cube(df, mask, version, filter_key, transform='log1p'):
+    """
+    Return the co-moment cube of the rows of the unfiltered dataset
+    `df` selected by `mask`, built once per filter state and reused
+    for every pair of columns.
+    """
+    full = get_correlation_cube if transform == 'log1p' else get_fit_cube
+    if mask.all():
+        return full(df, None, version)
+
+    key = (filter_key, transform)
+    with _cube_cache_lock:
+        cube = _cube_cache.get(key)
+        if cube is not None:
+            _cube_cache.move_to_end(key)
+            return cube
+
+    cube = _build_cube(df[mask], transform)
+
+    with _cube_cache_lock:
+        _cube_cache[key] = cube
+        while len(_cube_cache) > CUBE_CACHE_ENTRIES:
+            _cube_cache.popitem(last=False)
+
+    return cube
@@ -1,39 +1,580 @@
 import pandas as pd
+import numpy as np
 from dotenv import load_dotenv
+from collections import OrderedDict
+import pyarrow as pa
+import pyarrow.parquet as pq
+import s3fs
+import json
+import functools
+import threading
+import tempfile
+import hashlib
+import time
 import os
+import re
+
+from .analytics import verify_downcast
 
 load_dotenv()
 
 AWS_ACCESS_KEY = os.environ['AWS_ACCESS_KEY']
 AWS_SECRET = os.environ['AWS_SECRET']
 
+BUCKET = 'meta.idlewildtech.com'
+
+# Typed columnar copy of df_latest.csv written by `publish_snapshot`.
+SNAPSHOT = 'data/df_latest.parquet'
+
+# Seconds a cached object is served before S3 is asked whether it changed.
+CACHE_TTL = float(os.environ.get('DATASET_CACHE_TTL', 300))
+
+# Number of dataset versions kept resolvable for sessions opened
+# before the latest refresh.
+DATASET_HISTORY = int(os.environ.get('DATASET_HISTORY', 3))
+
+# How numeric columns are stored:
+#   'float64'  - as parsed
+#   'lossless' - float32 wherever every value survives the round trip
+#   'float32'  - float32 wherever values stay within FLOAT32_RTOL, and
+#                the fits and correlations derived from them agree
+STORAGE_POLICY = os.environ.get('DATASET_STORAGE_POLICY', 'float64')
+FLOAT32_RTOL = float(os.environ.get('FLOAT32_RTOL', 1e-6))
+
+# Local directory holding memory-mapped Arrow IPC mirrors of each dataset
+# version. Workers on the same host map the same file read-only, so they
+# share one physical copy of the numeric columns.
+MIRROR_DIR = os.environ.get(
+    'DATASET_MIRROR_DIR',
+    os.path.join(tempfile.gettempdir(), 'cnt-explorer')
+)
+
+# `_cache_lock` only guards the dicts below; slow work (S3 requests,
+# parsing, writing mirrors, load hooks) runs under a per-key lock
+# from `_build_lock`, so one build does not stall unrelated readers.
+_cache = {}
+_cache_lock = threading.RLock()
+_build_locks = {}
+
+_datasets = OrderedDict()
+_load_hooks = []
+
 
-def read_from_s3(bucket, filename, access_key=AWS_ACCESS_KEY, secret=AWS_SECRET):
+def get_fs(access_key=AWS_ACCESS_KEY, secret=AWS_SECRET):
+    # fsspec keeps one instance per set of arguments, so this is cheap
+    return s3fs.S3FileSystem(key=access_key, secret=secret)
+
+
+def read_from_s3(bucket, filename, access_key=AWS_ACCESS_KEY, secret=AWS_SECRET, **kwargs):
     pth = f"s3://{bucket}/{filename}"
     print(pth)
-    df = pd.read_csv(
+    read = pd.read_parquet if filename.endswith('.parquet') else pd.read_csv
+    df = read(
         pth,
         storage_options={
             "key": access_key,
             "secret": secret
-        }
+        },
+        **kwargs
     )
 
     return df
 
-def get_dd():
-    return read_from_s3('meta.idlewildtech.com', 'data/dd.csv').set_index('colname').to_dict()['coltype']
 
-def get_df():
-    df = read_from_s3('meta.idlewildtech.com', 'data/df_latest.csv')
+def get_object_version(bucket, filename):
+    """
+    Return the ETag (or Last-Modified time) of an S3 object
+    using a HEAD request, without downloading the body.
+
+    Returns None if the object does not exist.
+    """
+    fs = get_fs()
+    pth = f"{bucket}/{filename}"
+    fs.invalidate_cache(pth)
+    try:
+        info = fs.info(pth)
+    except FileNotFoundError:
+        return None
+    return info.get('ETag') or str(info.get('LastModified'))
+
+
+def _build_lock(key):
+    with _cache_lock:
+        return _build_locks.setdefault(key, threading.RLock())
+
+
+def cached(key, get_version, build=None, ttl=None):
+    """
+    Return the value cached under `key`, rebuilding it with `build()`
+    only when the version reported by `get_version()` has changed.
+
+    The version is checked at most once every `ttl` seconds.
+    Without `build`, the version itself is cached.
+    """
+    ttl = CACHE_TTL if ttl is None else ttl
+
+    with _cache_lock:
+        entry = _cache.get(key)
+    if entry is not None and time.monotonic() - entry['checked'] < ttl:
+        return entry['value']
+
+    with _build_lock(('cached', key)):
+        # another thread may have refreshed the entry while we waited
+        with _cache_lock:
+            entry = _cache.get(key)
+        now = time.monotonic()
+        if entry is not None and now - entry['checked'] < ttl:
+            return entry['value']
+
+        version = get_version()
+
+        if entry is not None and entry['version'] == version:
+            with _cache_lock:
+                entry['checked'] = now
+            return entry['value']
+
+        value = version if build is None else build()
+        with _cache_lock:
+            _cache[key] = {'version': version, 'checked': now, 'value': value}
+
+        return value
+
+
+def invalidate_cache(key=None):
+    """
+    Drop `key` from the dataset cache, or everything if `key` is None.
+    """
+    with _cache_lock:
+        if key is None:
+            _cache.clear()
+        else:
+            _cache.pop(key, None)
+
+
+def _get_dd():
+    return read_from_s3(BUCKET, 'data/dd.csv').set_index('colname').to_dict()['coltype']
+
+
+def _read_csv_df():
+    df = read_from_s3(BUCKET, 'data/df_latest.csv')
     dd = get_dd()
 
     for c in df:
         if dd[c] == 'numeric':
             df[c] = pd.to_numeric(df[c], errors='coerce')
 
+    return encode_categoricals(df.replace('NaN', np.nan), dd)
+
+
+def encode_categoricals(df, dd):
+    """
+    Convert every non-numeric `dd` column to a Categorical whose
+    categories are its distinct values in sorted order, so the
+    dictionary is stable for a given dataset version.
+    """
+    for c in df:
+        if dd.get(c) != 'numeric' and not isinstance(df[c].dtype, pd.CategoricalDtype):
+            categories = sorted(df[c].dropna().unique(), key=str)
+            df[c] = pd.Categorical(df[c], categories=categories)
+
     return df
 
-def get_df_for_download(file):
-    if file == 'original':
-        return read_from_s3('meta.idlewildtech.com', 'data/df_original.csv')
+
+def downcast_numeric(df, dd, policy=STORAGE_POLICY, rtol=FLOAT32_RTOL):
+    """
+    Store numeric `dd` columns as float32 where `policy` allows it.
+
+    Returns the new frame and a report of each column's dtype and
+    memory use before and after.
+    """
+    records = []
+    df = df.copy()
+
+    for c in df:
+        if dd.get(c) != 'numeric' or df[c].dtype != np.float64:
+            continue
+
+        values = df[c].to_numpy()
+        small = values.astype(np.float32)
+        back = small.astype(np.float64)
+
+        if policy == 'lossless':
+            ok = np.array_equal(back, values, equal_nan=True)
+        elif policy == 'float32':
+            ok = np.allclose(back, values, rtol=rtol, atol=0, equal_nan=True)
+        else:
+            ok = False
+
+        if ok:
+            df[c] = small
+
+        records.append({
+            'column': c,
+            'dtype_before': str(values.dtype),
+            'dtype_after': str(df[c].dtype),
+            'bytes_before': values.nbytes,
+            'bytes_after': df[c].to_numpy().nbytes
+        })
+
+    report = pd.DataFrame(
+        records,
+        columns=['column', 'dtype_before', 'dtype_after', 'bytes_before', 'bytes_after']
+    )
+
+    return df, report
+
+
+def apply_storage_policy(df, dd, policy=STORAGE_POLICY):
+    """
+    Downcast `df` per `policy`. For the lossy 'float32' policy, columns
+    whose regression or Pearson outputs move beyond tolerance in any
+    pairing are restored to float64.
+    """
+    small, report = downcast_numeric(df, dd, policy)
+
+    if policy == 'float32':
+        cols = [c for c in df if dd.get(c) == 'numeric']
+        for x, y in verify_downcast(df, small, cols):
+            for c in (x, y):
+                small[c] = df[c]
+
+        report['dtype_after'] = [str(small[c].dtype) for c in report['column']]
+        report['bytes_after'] = [small[c].to_numpy().nbytes for c in report['column']]
+
+    saved = report['bytes_before'].sum() - report['bytes_after'].sum()
+    print(f'Storage policy {policy!r} saved {saved} bytes')
+
+    return small, report
+
+
+def get_storage_report(version):
+    """
+    Return the per-column downcasting report stored with the
+    local mirror of a dataset version, or None.
+    """
+    with pa.memory_map(get_mirror_path(version), 'r') as source:
+        metadata = pa.ipc.open_file(source).schema.metadata
+
+    if b'storage' not in metadata:
+        return None
+    return pd.DataFrame(json.loads(metadata[b'storage']))
+
+
+def _get_df():
+    # prefer the typed snapshot; types were coerced when it was published
+    snapshot = read_snapshot_metadata()
+    if snapshot is not None:
+        if snapshot['dd'] and snapshot['source'] == _get_source_versions():
+            df = read_from_s3(BUCKET, SNAPSHOT)
+            # snapshots published before categorical encoding
+            return encode_categoricals(df, snapshot['dd'])
+
+        print('Parquet snapshot is out of date, reading df_latest.csv')
+
+    return _read_csv_df()
+
+
+def get_dd():
+    return cached(
+        'dd',
+        lambda: get_object_version(BUCKET, 'data/dd.csv'),
+        _get_dd
+    )
+
+
+def _get_df_versions():
+    return (
+        get_object_version(BUCKET, SNAPSHOT),
+        get_object_version(BUCKET, 'data/df_latest.csv'),
+        get_object_version(BUCKET, 'data/dd.csv')
+    )
+
+
+def get_original_path():
+    """
+    Return the path of a local copy of df_original.csv, downloaded
+    again only when its ETag changes.
+    """
+    etag = cached('df_original_file', lambda: get_object_version(BUCKET, 'data/df_original.csv'))
+    name = hashlib.sha1(str(etag).encode()).hexdigest()[:12]
+    path = os.path.join(MIRROR_DIR, f'original_{name}.csv')
+
+    if not os.path.exists(path):
+        os.makedirs(MIRROR_DIR, exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        get_fs().get(f'{BUCKET}/data/df_original.csv', tmp)
+        os.replace(tmp, path)
+
+    return path
+
+
+# Dataset versions are the first 12 hex digits of a sha1, see
+# `get_dataset_version`.
+_VERSION_RE = re.compile(r'[0-9a-f]{12}')
+
+
+def is_version_token(version):
+    return isinstance(version, str) and bool(_VERSION_RE.fullmatch(version))
+
+
+def get_mirror_path(version):
+    if not is_version_token(version):
+        raise ValueError(f'Invalid dataset version {version!r}')
+    return os.path.join(MIRROR_DIR, f'df_{version}_{STORAGE_POLICY}.arrow')
+
+
+def write_mirror(df, dd, version, report=None):
+    """
+    Write `df` to the local Arrow IPC mirror for `version`.
+
+    The file is written under a temporary name and moved into place,
+    so readers only ever see complete files.
+    """
+    path = get_mirror_path(version)
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(MIRROR_DIR, exist_ok=True)
+
+    # keep NaN (rather than null) in float columns so they can be
+    # mapped into pandas without copying; categoricals become
+    # dictionary-encoded arrays
+    table = pa.table({
+        c: pa.array(df[c].to_numpy(), from_pandas=False)
+        if df[c].dtype.kind == 'f'
+        else pa.array(df[c], from_pandas=True)
+        for c in df
+    })
+    metadata = {b'dd': json.dumps(dd).encode()}
+    if report is not None:
+        metadata[b'storage'] = report.to_json(orient='records').encode()
+    table = table.replace_schema_metadata(metadata)
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with pa.OSFile(tmp, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+    _prune_mirrors()
+
+    return path
+
+
+def read_mirror(version):
+    """
+    Memory-map the local mirror for `version` and return `(df, dd)`.
+
+    Numeric columns without nulls point straight into the shared
+    mapping and are read-only.
+    """
+    source = pa.memory_map(get_mirror_path(version), 'r')
+    table = pa.ipc.open_file(source).read_all()
+    dd = json.loads(table.schema.metadata[b'dd'])
+    df = table.to_pandas(split_blocks=True)
+
+    return df, dd
+
+
+def _prune_mirrors():
+    # mapped files stay valid after unlinking, so older versions can go
+    paths = sorted(
+        (
+            os.path.join(MIRROR_DIR, f) for f in os.listdir(MIRROR_DIR)
+            if f.startswith('df_') and f.endswith('.arrow')
+        ),
+        key=os.path.getmtime
+    )
+    for path in paths[:-DATASET_HISTORY]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def memoize_by_version(build):
+    """
+    Cache `build(df, dd)` per dataset version for the last
+    DATASET_HISTORY versions. The wrapped function takes an extra
+    `version` argument; calls without one are not cached.
+    """
+    memo = OrderedDict()
+
+    @functools.wraps(build)
+    def wrapper(df, dd, version=None):
+        if version is None:
+            return build(df, dd)
+
+        # a stale token may have been resolved to a newer frame
+        def lookup():
+            with _cache_lock:
+                entry = memo.get(version)
+            if entry is not None and entry[0] is df:
+                return entry
+
+        entry = lookup()
+        if entry is None:
+            with _build_lock((wrapper, version)):
+                entry = lookup()
+                if entry is None:
+                    entry = (df, build(df, dd))
+                    with _cache_lock:
+                        memo[version] = entry
+                        while len(memo) > DATASET_HISTORY:
+                            memo.popitem(last=False)
+
+        return entry[1]
+
+    wrapper.cache_clear = memo.clear
+    return wrapper
+
+
+def get_dataset_version():
+    """
+    Return a short token identifying the latest dataset in S3.
+    """
+    versions = cached('dataset', _get_df_versions)
+    return hashlib.sha1(repr(versions).encode()).hexdigest()[:12]
+
+
+def on_dataset_load(hook):
+    """
+    Register `hook(df, dd, version)` to run whenever a dataset version
+    is registered on this worker, to precompute per-version artifacts.
+    """
+    _load_hooks.append(hook)
+    return hook
+
+
+def _register_dataset(version, dataset):
+    with _cache_lock:
+        _datasets[version] = dataset
+        while len(_datasets) > DATASET_HISTORY:
+            _datasets.popitem(last=False)
+
+    for hook in _load_hooks:
+        hook(*dataset, version)
+
+
+def _is_registered(version):
+    with _cache_lock:
+        return version in _datasets
+
+
+def load_dataset():
+    """
+    Load the latest dataset and register it under a short version token.
+
+    The first worker to see a new version writes the local mirror;
+    every worker then memory-maps it.
+
+    Returns the token, which is all the client needs to hold.
+    """
+    version = get_dataset_version()
+    if _is_registered(version):
+        return version
+
+    with _build_lock(('dataset', version)):
+        if not _is_registered(version):
+            if not os.path.exists(get_mirror_path(version)):
+                # the frame is only needed until the mirror is written,
+                # so it is not kept in the dataset cache
+                dd = get_dd()
+                df, report = apply_storage_policy(_get_df(), dd)
+                write_mirror(df, dd, version, report)
+            _register_dataset(version, read_mirror(version))
+
+    return version
+
+
+def resolve_version(version):
+    """
+    Return `version` if it can be resolved on this worker, else the
+    latest version.
+
+    Tokens issued by another worker on this host are mapped from the
+    local mirror. Anything that is not a version token falls back to
+    the latest version before touching the filesystem.
+    """
+    if not is_version_token(version):
+        print(f'Invalid dataset version {version!r}, using latest')
+        return load_dataset()
+
+    if _is_registered(version):
+        return version
+
+    # only tokens with a mirror get a build lock
+    if os.path.exists(get_mirror_path(version)):
+        with _build_lock(('dataset', version)):
+            if not _is_registered(version):
+                _register_dataset(version, read_mirror(version))
+        return version
+
+    print(f'Unknown dataset version {version}, using latest')
+    return load_dataset()
+
+
+def get_dataset(version):
+    """
+    Resolve a version token from `load_dataset` to its `(df, dd)` pair.
+
+    Unknown tokens resolve to the latest dataset; callers that key
+    caches on the token should pass it through `resolve_version` first.
+    """
+    version = resolve_version(version)
+    with _cache_lock:
+        return _datasets[version]
+
+
+def _get_source_versions():
+    return {
+        'csv': get_object_version(BUCKET, 'data/df_latest.csv'),
+        'dd': get_object_version(BUCKET, 'data/dd.csv')
+    }
+
+
+def read_snapshot_metadata(bucket=BUCKET):
+    """
+    Return the `source` ETags and the data dictionary `dd` embedded
+    in the Parquet snapshot (None where missing), or None if no
+    snapshot has been published.
+    """
+    try:
+        with get_fs().open(f'{bucket}/{SNAPSHOT}', 'rb') as f:
+            metadata = pq.read_schema(f).metadata or {}
+    except FileNotFoundError:
+        return None
+
+    return {
+        k: json.loads(metadata[k.encode()]) if k.encode() in metadata else None
+        for k in ('source', 'dd')
+    }
+
+
+def publish_snapshot(bucket=BUCKET):
+    """
+    Coerce df_latest.csv with the data dictionary and publish it
+    as a Parquet snapshot next to the CSV, with `dd` and the ETags
+    of both sources embedded in the schema metadata. Readers fall
+    back to the CSV once either source changes.
+    """
+    # taken first, so a change during publishing marks it stale
+    source = _get_source_versions()
+    df = _read_csv_df()
+    dd = get_dd()
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        b'dd': json.dumps(dd).encode(),
+        b'source': json.dumps(source).encode()
+    })
+
+    with get_fs().open(f'{bucket}/{SNAPSHOT}', 'wb') as f:
+        pq.write_table(table, f)
+
+    invalidate_cache()
+
+
+if __name__ == '__main__':
+    publish_snapshot()
@@ -0,0 +1,257 @@
+from flask import Blueprint, Response, abort, request
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pandas as pd
+import numpy as np
+import hashlib
+import shutil
+import zlib
+import time
+import os
+
+from .db import (
+    AWS_SECRET, MIRROR_DIR, DATASET_HISTORY,
+    resolve_version, get_dataset, get_original_path
+)
+from .filters import get_filter_mask, filter_state_key
+
+# Key for signing download URLs. It must be the same on every worker;
+# by default it is derived from the AWS secret.
+DOWNLOAD_SECRET = os.environ.get('DOWNLOAD_SECRET') or \
+    hashlib.sha256(b'downloads:' + AWS_SECRET.encode()).hexdigest()
+
+# Seconds a signed download URL stays valid.
+DOWNLOAD_URL_TTL = int(os.environ.get('DOWNLOAD_URL_TTL', 600))
+
+# Rows serialized per chunk when streaming a frame as CSV.
+CHUNK_ROWS = 5000
+
+# Bytes read per chunk when streaming a file.
+CHUNK_BYTES = 2**16
+
+# Export format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', '.csv'),
+    'csv.gz': ('application/gzip', '.csv.gz'),
+    'parquet': ('application/vnd.apache.parquet', '.parquet'),
+    'feather': ('application/vnd.apache.arrow.file', '.feather'),
+}
+
+EXPORT_DIR = os.path.join(MIRROR_DIR, 'exports')
+
+downloads = Blueprint('downloads', __name__)
+
+_serializer = URLSafeTimedSerializer(DOWNLOAD_SECRET, salt='download')
+
+
+def sign_download(kind, version, filters=None, fmt='csv', cache=True):
+    """
+    Return a signed, expiring path for downloading `kind`
+    ('original', 'latest' or 'filtered') of a dataset version
+    in one of EXPORT_FORMATS.
+
+    `filters` holds the `get_filter_mask` arguments for 'filtered'.
+    Pass `cache=False` for one-off filter states, so their exports are
+    not kept on disk.
+    """
+    token = _serializer.dumps({
+        'kind': kind,
+        'version': version,
+        'filters': filters,
+        'format': fmt,
+        'cache': cache
+    })
+    return f'/download/{token}'
+
+
+def iter_csv(df, rows=None, chunk_rows=CHUNK_ROWS):
+    """
+    Yield `df` (or only the row positions in `rows`) as CSV,
+    `chunk_rows` rows at a time.
+    """
+    rows = np.arange(len(df)) if rows is None else rows
+
+    if not len(rows):
+        yield df.iloc[:0].to_csv()
+        return
+
+    for start in range(0, len(rows), chunk_rows):
+        chunk = df.iloc[rows[start:start + chunk_rows]]
+        yield chunk.to_csv(header=start == 0)
+
+
+def iter_file(path, chunk_bytes=CHUNK_BYTES, remove=False):
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(chunk_bytes)
+                if not block:
+                    return
+                yield block
+    finally:
+        if remove:
+            os.remove(path)
+
+
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        yield compressor.compress(chunk)
+    yield compressor.flush()
+
+
+def write_export(df, rows, fmt, path, chunk_rows=CHUNK_ROWS):
+    """
+    Write `df` (or only the row positions in `rows`) to `path` in
+    `fmt`, `chunk_rows` rows at a time. The file is moved into place
+    once complete.
+    """
+    rows = np.arange(len(df)) if rows is None else rows
+    tmp = f'{path}.{os.getpid()}.tmp'
+
+    if fmt == 'csv':
+        with open(tmp, 'w') as f:
+            for block in iter_csv(df, rows, chunk_rows):
+                f.write(block)
+
+    elif fmt == 'csv.gz':
+        with open(tmp, 'wb') as f:
+            for block in iter_gzip(iter_csv(df, rows, chunk_rows)):
+                f.write(block)
+
+    else:
+        schema = pa.Schema.from_pandas(df, preserve_index=False)
+        if fmt == 'parquet':
+            writer = pq.ParquetWriter(tmp, schema)
+        else:
+            writer = pa.ipc.new_file(tmp, schema)
+
+        with writer:
+            for start in range(0, len(rows), chunk_rows):
+                chunk = df.iloc[rows[start:start + chunk_rows]]
+                writer.write_table(
+                    pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+                )
+
+    os.replace(tmp, path)
+    return path
+
+
+def _prune_exports():
+    dirs = sorted(
+        (
+            os.path.join(EXPORT_DIR, d) for d in os.listdir(EXPORT_DIR)
+            if d != 'tmp'
+        ),
+        key=os.path.getmtime
+    )
+    for d in dirs[:-DATASET_HISTORY]:
+        shutil.rmtree(d, ignore_errors=True)
+
+
+def get_export(key, fmt, load, cache=True):
+    """
+    Return `(path, temporary)` for an export of the frame returned by
+    `load()` as `(df, rows)`. Cached exports live under
+    `EXPORT_DIR/<key>` and are generated once.
+    """
+    ext = EXPORT_FORMATS[fmt][1]
+    directory = os.path.join(EXPORT_DIR, key if cache else 'tmp')
+    os.makedirs(directory, exist_ok=True)
+
+    if not cache:
+        path = os.path.join(directory, f'{os.getpid()}_{time.time_ns()}{ext}')
+        return write_export(*load(), fmt, path), True
+
+    path = os.path.join(directory, f'export{ext}')
+    if not os.path.exists(path):
+        write_export(*load(), fmt, path)
+        _prune_exports()
+
+    return path, False
+
+
+@downloads.route('/download/<token>')
+def download(token):
+    try:
+        spec = _serializer.loads(token, max_age=DOWNLOAD_URL_TTL)
+    except BadSignature:
+        abort(403)
+
+    kind = spec['kind']
+    fmt = spec.get('format', 'csv')
+    ts = int(time.time())
+
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+
+    if kind == 'original':
+        original = get_original_path()
+
+        if fmt == 'csv':
+            chunks = iter_file(original)
+        else:
+            key = os.path.splitext(os.path.basename(original))[0]
+            path, temporary = get_export(
+                key, fmt, lambda: (pd.read_csv(original), None)
+            )
+            chunks = iter_file(path, remove=temporary)
+
+    elif kind in ('latest', 'filtered'):
+        version = resolve_version(spec['version'])
+        df, dd = get_dataset(version)
+        key = f'{version}/latest'
+
+        def load():
+            if kind == 'latest':
+                return df, None
+
+            f = spec['filters']
+            mask = get_filter_mask(
+                f['legend'],
+                f['dope'],
+                df, dd,
+                f['ctrl_values'],
+                f['ctrl_idx'],
+                f['null_values'],
+                f['apply_filters'],
+                version=version
+            )
+            return df, np.flatnonzero(mask.to_numpy())
+
+        if kind == 'filtered':
+            f = spec['filters']
+            key = f'{version}/' + filter_state_key(
+                version,
+                f['legend'],
+                f['dope'],
+                f['apply_filters'],
+                f['ctrl_values'],
+                f['ctrl_idx'],
+                f['null_values']
+            )[:12]
+
+        if fmt == 'csv':
+            chunks = iter_csv(*load())
+        else:
+            path, temporary = get_export(
+                key, fmt, load, cache=kind == 'latest' or spec.get('cache', True)
+            )
+            chunks = iter_file(path, remove=temporary)
+
+    else:
+        abort(404)
+
+    mimetype, ext = EXPORT_FORMATS[fmt]
+    headers = {
+        'Content-Disposition': f'attachment; filename="database_{kind}_{ts}{ext}"'
+    }
+
+    if fmt == 'csv' and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        chunks = iter_gzip(chunks)
+        headers['Content-Encoding'] = 'gzip'
+
+    return Response(chunks, mimetype=mimetype, headers=headers)
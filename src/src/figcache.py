@@ -0,0 +1,232 @@
+from collections import OrderedDict
+import threading
+import hashlib
+import sqlite3
+import json
+import glob
+import time
+import os
+
+from .db import MIRROR_DIR
+from .plotting import WEBGL_THRESHOLD, FIG2_MAX_POINTS, DECIMATION_BINS
+
+# 'memory' keeps figures in each worker; 'sqlite' shares them between
+# all workers on the host through a local database file.
+FIGURE_CACHE_BACKEND = os.environ.get('FIGURE_CACHE_BACKEND', 'memory')
+FIGURE_CACHE_BYTES = int(os.environ.get('FIGURE_CACHE_BYTES', 64 * 2**20))
+FIGURE_CACHE_PATH = os.environ.get(
+    'FIGURE_CACHE_PATH',
+    os.path.join(MIRROR_DIR, 'figures.sqlite')
+)
+
+_stats = {'hits': 0, 'misses': 0}
+
+
+# Source files whose code renders cached figures; hashed, with
+# APP_VERSION (e.g. the deployed commit), into the render fingerprint.
+_render_sources = sorted(glob.glob(os.path.join(os.path.dirname(__file__), '*.py')))
+_fingerprint = None
+
+
+def register_render_source(path):
+    """
+    Add a source file outside this package (e.g. a page building
+    tables) to the render fingerprint.
+    """
+    global _fingerprint
+    _render_sources.append(path)
+    _fingerprint = None
+
+
+def render_fingerprint():
+    """
+    Return everything besides the data that changes how figures are
+    rendered, so that entries cached by another configuration or
+    deploy are never served.
+    """
+    global _fingerprint
+    if _fingerprint is None:
+        h = hashlib.sha1(os.environ.get('APP_VERSION', '').encode())
+        for path in _render_sources:
+            with open(path, 'rb') as f:
+                h.update(f.read())
+
+        _fingerprint = (
+            h.hexdigest()[:12],
+            WEBGL_THRESHOLD,
+            FIG2_MAX_POINTS,
+            DECIMATION_BINS
+        )
+    return _fingerprint
+
+
+class MemoryBackend:
+    """
+    In-process LRU of serialized figures, bounded by total size.
+    """
+
+    def __init__(self, max_bytes=FIGURE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._items:
+                self.size -= len(self._items.pop(key))
+            self._items[key] = value
+            self.size += len(value)
+
+            while self.size > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+class SQLiteBackend:
+    """
+    LRU of serialized figures in a local SQLite file, shared by every
+    worker on the host and bounded by total size.
+    """
+
+    def __init__(self, path=FIGURE_CACHE_PATH, max_bytes=FIGURE_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+
+    def _connect(self):
+        # connections can't cross a fork or a thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS figures ('
+                'key TEXT PRIMARY KEY, value TEXT, size INTEGER, accessed REAL)'
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT value FROM figures WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        with conn:
+            conn.execute(
+                'UPDATE figures SET accessed = ? WHERE key = ?',
+                (time.time(), key)
+            )
+        return row[0]
+
+    def set(self, key, value):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO figures VALUES (?, ?, ?, ?)',
+                (key, value, len(value), time.time())
+            )
+            size, = conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM figures'
+            ).fetchone()
+
+            # evict least recently used entries until under budget
+            for k, s in conn.execute(
+                'SELECT key, size FROM figures ORDER BY accessed'
+            ).fetchall():
+                if size <= self.max_bytes:
+                    break
+                conn.execute('DELETE FROM figures WHERE key = ?', (k,))
+                size -= s
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM figures')
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'sqlite': SQLiteBackend,
+}
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = BACKENDS[FIGURE_CACHE_BACKEND]()
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Replace the cache backend with any object providing
+    `get(key)`, `set(key, value)` and `clear()`.
+    """
+    global _backend
+    _backend = backend
+
+
+def figure_key(*parts):
+    """
+    Hash the parts a figure depends on (dataset version, filter state
+    key, graph options) and the `render_fingerprint()` into a cache key.
+    """
+    return hashlib.sha1(
+        json.dumps(
+            [render_fingerprint(), *parts], sort_keys=True, default=str
+        ).encode()
+    ).hexdigest()
+
+
+def _cached(key, build):
+    backend = get_backend()
+    value = backend.get(key)
+
+    if value is None:
+        _stats['misses'] += 1
+        value = build()
+        backend.set(key, value)
+    else:
+        _stats['hits'] += 1
+
+    return json.loads(value)
+
+
+def cached_figure(key, build):
+    """
+    Return the figure cached under `key` as a plain dict, calling
+    `build()` for a plotly Figure and caching its JSON on a miss.
+    """
+    return _cached(key, lambda: build().to_json())
+
+
+def cached_value(key, build):
+    """
+    Like `cached_figure`, for anything JSON-serializable
+    (e.g. table records).
+    """
+    return _cached(key, lambda: json.dumps(build(), default=str))
+
+
+def figure_cache_info():
+    return dict(_stats)
@@ -1,11 +1,40 @@
 from dash import html, dcc
 import dash_bootstrap_components as dbc
+import pandas as pd
+import numpy as np
+from collections import OrderedDict
+import threading
+import hashlib
+import base64
+import json
+import os
 
-def generate_filter_control(c, df, dd, ctrl_value=None, null_value=None):
+from .db import memoize_by_version
+
+CATEGORY_COL = 'Category'
+DOPE_COL = 'Doped or Acid Exposure (Yes/ No)'
+
+# Upper bound on the memory held by cached filter masks.
+MASK_CACHE_BYTES = int(os.environ.get('MASK_CACHE_BYTES', 32 * 2**20))
+
+_mask_cache = OrderedDict()
+_mask_cache_lock = threading.Lock()
+_mask_cache_stats = {'hits': 0, 'misses': 0, 'bytes': 0}
+
+def generate_filter_control(
+    c, 
+    profile, 
+    ctrl_value=None, 
+    null_value=None, 
+    updatemode='mouseup'
+):
     """
-    Given a column name `c`,
-    generate an appropriate filter control based
-    on the column type and values.
+    Given a column name `c` and its profile (see
+    `profiles.get_column_profiles`), generate an appropriate
+    filter control based on the column type and values.
+
+    `updatemode` is passed to range sliders; 'drag' updates their
+    value while dragging.
     """
         
     control = None
@@ -14,26 +43,26 @@ def generate_filter_control(c, df, dd, ctrl_value=None, null_value=None):
         None        
     ]
     
-    if dd[c] == 'numeric':
+    if profile['type'] == 'numeric':
         
-        rng = [
-            df[c].astype(float).min(),
-            df[c].astype(float).max()
-        ]
+        rng = [profile['min'], profile['max']]
         
         ctrl_value = ctrl_value if ctrl_value else rng
         
         control = dcc.RangeSlider(
             *rng,
             value=ctrl_value,
+            updatemode=updatemode,
             id={'type': 'filter-control', 'column': c}
         )
     else:
         
-        ctrl_value = ctrl_value if ctrl_value else df[c].unique()
+        values = profile['values']
+        if not ctrl_value:
+            ctrl_value = values + [None] if profile['nulls'] else values
         
         control = dcc.Dropdown(
-            df[c].dropna().unique(),
+            values,
             value=ctrl_value,
             multi=True, 
             placeholder=c, 
@@ -58,7 +87,169 @@ def generate_filter_control(c, df, dd, ctrl_value=None, null_value=None):
     return html.Div(res, style={'margin-top': '1rem'})
 
 
-def get_filter_mask(
+class FilterIndex:
+    """
+    Lookup structures for answering `get_filter_mask` queries on one
+    dataset version without rescanning the frame.
+
+    Numeric columns keep their non-null values sorted along with the
+    argsort permutation, so a range is two binary searches. Other columns
+    use their categorical (or factorized) codes to keep one bitmap per
+    distinct value, so `isin` is an OR of bitmaps. Null bitmaps are kept for every column.
+
+    Structures are built lazily, the first time a column is queried.
+    """
+
+    def __init__(self, df, dd):
+        self.df = df
+        self.dd = dd
+        self.n = len(df)
+        self._nulls = {}
+        self._sorted = {}
+        self._bitmaps = {}
+
+    def nulls(self, c):
+        if c not in self._nulls:
+            self._nulls[c] = self.df[c].isnull().to_numpy()
+        return self._nulls[c]
+
+    def between(self, c, lo, hi):
+        if c not in self._sorted:
+            values = self.df[c].to_numpy(dtype=float)
+            valid = np.flatnonzero(~np.isnan(values))
+            order = valid[np.argsort(values[valid], kind='stable')]
+            self._sorted[c] = (values[order], order)
+
+        values, order = self._sorted[c]
+        i = np.searchsorted(values, lo, side='left')
+        j = np.searchsorted(values, hi, side='right')
+
+        mask = np.zeros(self.n, dtype=bool)
+        mask[order[i:j]] = True
+        return mask
+
+    def isin(self, c, wanted):
+        if c not in self._bitmaps:
+            col = self.df[c]
+            if isinstance(col.dtype, pd.CategoricalDtype):
+                codes, uniques = col.cat.codes.to_numpy(), col.cat.categories
+            else:
+                codes, uniques = pd.factorize(col)
+            self._bitmaps[c] = {
+                v: codes == i for i, v in enumerate(uniques)
+            }
+
+        bitmaps = self._bitmaps[c]
+        mask = np.zeros(self.n, dtype=bool)
+        for v in wanted:
+            # like pandas.isin, a null in `wanted` matches null rows
+            if pd.isnull(v):
+                mask |= self.nulls(c)
+            elif v in bitmaps:
+                mask |= bitmaps[v]
+        return mask
+
+
+@memoize_by_version
+def get_filter_index(df, dd):
+    return FilterIndex(df, dd)
+
+
+def _b64(values):
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+
+@memoize_by_version
+def get_client_columns(df, dd):
+    """
+    Encode the columns `get_filter_mask` can filter on for the
+    browser-side filter engine (assets/filters.js), as base64
+    little-endian typed arrays in row order.
+
+    Numeric columns are float64 with NaN for null; other columns are
+    int32 codes into their `categories`, with -1 for null.
+    """
+    columns = {}
+
+    for c in [CATEGORY_COL, DOPE_COL, *dd]:
+        if c in columns or c not in df:
+            continue
+
+        col = df[c]
+        if dd.get(c) == 'numeric':
+            columns[c] = {
+                'dtype': 'float64',
+                'data': _b64(col.to_numpy(dtype='<f8', na_value=np.nan))
+            }
+        else:
+            if isinstance(col.dtype, pd.CategoricalDtype):
+                codes, uniques = col.cat.codes.to_numpy(), col.cat.categories
+            else:
+                codes, uniques = pd.factorize(col)
+            columns[c] = {
+                'dtype': 'int32',
+                'data': _b64(codes.astype('<i4')),
+                'categories': pd.Index(uniques).tolist()
+            }
+
+    return {
+        'n': len(df),
+        'category': CATEGORY_COL,
+        'dope': DOPE_COL,
+        'columns': columns
+    }
+
+
+def filter_state_key(
+    version,
+    legend,
+    dope,
+    apply_filters,
+    ctrl_values,
+    ctrl_idx,
+    null_values
+):
+    """
+    Return a canonical hash of a filter state, so that equivalent
+    states (e.g. the same legend in a different order) share a key.
+    """
+    controls = []
+    if ctrl_values and apply_filters:
+        controls = sorted(
+            (
+                [i['column'], v, bool(n)]
+                for i, v, n in zip(ctrl_idx, ctrl_values, null_values)
+            ),
+            key=lambda ctrl: ctrl[0]
+        )
+
+    state = {
+        'version': version,
+        'legend': sorted(legend or [], key=str),
+        'dope': sorted(dope or [], key=str),
+        'controls': controls
+    }
+
+    return hashlib.sha1(
+        json.dumps(state, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def mask_cache_info():
+    """
+    Return hit/miss counters and the size of the filter mask cache.
+    """
+    with _mask_cache_lock:
+        return dict(_mask_cache_stats, entries=len(_mask_cache))
+
+
+def mask_cache_clear():
+    with _mask_cache_lock:
+        _mask_cache.clear()
+        _mask_cache_stats.update(hits=0, misses=0, bytes=0)
+
+
+def _compute_filter_mask(
     legend, 
     dope, 
     df,
@@ -66,31 +257,84 @@ def get_filter_mask(
     ctrl_values, 
     ctrl_idx, 
     null_values,
-    apply_filters
+    apply_filters,
+    version
 ):
-    """
-    Given a list of `filters`, the `legend` and `dope` controls,
-    and a pandas `df`, build a mask.
-    """
-    
+    index = get_filter_index(df, dd, version)
     ctrl_cols = [i['column'] for i in ctrl_idx]
     
-    mask = df['Category'].isin(legend) & \
-    df['Doped or Acid Exposure (Yes/ No)'].isin(dope)
+    mask = index.isin(CATEGORY_COL, legend) & index.isin(DOPE_COL, dope)
     
-    if not ctrl_values or not apply_filters:
-        return mask
+    if ctrl_values and apply_filters:
     
-    for i,c in enumerate(ctrl_cols):   
-        if dd[c] == 'numeric':
-            m = df[c].between(*ctrl_values[i])
-            if null_values[i]:
-                m = m | df[c].isnull()
-        else:
-            m = df[c].isin(ctrl_values[i])
+        for i,c in enumerate(ctrl_cols):   
+            if dd[c] == 'numeric':
+                m = index.between(c, *ctrl_values[i])
+            else:
+                m = index.isin(c, ctrl_values[i])
+
             if null_values[i]:
-                m = m | df[c].isnull()
+                m = m | index.nulls(c)
+            
+            mask &= m
         
-        mask = mask & m
-        
-    return mask
\ No newline at end of file
+    return mask
+
+
+def get_filter_mask(
+    legend, 
+    dope, 
+    df,
+    dd,
+    ctrl_values, 
+    ctrl_idx, 
+    null_values,
+    apply_filters,
+    version=None
+):
+    """
+    Given a list of `filters`, the `legend` and `dope` controls,
+    and a pandas `df`, build a mask.
+
+    Pass the dataset `version` to reuse its `FilterIndex` and to
+    memoize the mask in a bounded LRU cache.
+    """
+
+    if version is None:
+        mask = _compute_filter_mask(
+            legend, dope, df, dd,
+            ctrl_values, ctrl_idx, null_values, apply_filters,
+            version
+        )
+        return pd.Series(mask, index=df.index)
+
+    key = filter_state_key(
+        version, legend, dope, apply_filters,
+        ctrl_values, ctrl_idx, null_values
+    )
+
+    with _mask_cache_lock:
+        packed = _mask_cache.get(key)
+        if packed is not None:
+            _mask_cache.move_to_end(key)
+            _mask_cache_stats['hits'] += 1
+
+    if packed is None:
+        mask = _compute_filter_mask(
+            legend, dope, df, dd,
+            ctrl_values, ctrl_idx, null_values, apply_filters,
+            version
+        )
+        packed = np.packbits(mask)
+
+        with _mask_cache_lock:
+            _mask_cache_stats['misses'] += 1
+            if key not in _mask_cache:
+                _mask_cache[key] = packed
+                _mask_cache_stats['bytes'] += packed.nbytes
+            while _mask_cache_stats['bytes'] > MASK_CACHE_BYTES:
+                _, evicted = _mask_cache.popitem(last=False)
+                _mask_cache_stats['bytes'] -= evicted.nbytes
+    
+    mask = np.unpackbits(packed, count=len(df)).astype(bool)
+    return pd.Series(mask, index=df.index)
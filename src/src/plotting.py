@@ -4,8 +4,9 @@ import plotly.express as px
 import pandas as pd
 import numpy as np
 import math
-from sklearn.linear_model import LinearRegression
+import os
 
+from .analytics import grouped_loglog_fit
 from .benchmarks import BENCHMARK_COLORS
 
 MARKERS = {
@@ -100,52 +101,139 @@ MARKERS = {
     }
 }
 
-def construct_custom_strip(df, x, y):
+# Above this many points, scatter and strip plots are drawn with WebGL
+# (Scattergl) instead of SVG.
+WEBGL_THRESHOLD = int(os.environ.get('WEBGL_THRESHOLD', 1000))
+
+# Most points drawn in graph 2 before the view is decimated;
+# 0 draws every point.
+FIG2_MAX_POINTS = int(os.environ.get('FIG2_MAX_POINTS', 0))
+
+# Grid size (per axis) of the log-space bins used for decimation.
+DECIMATION_BINS = 64
+
+# Order of categories along the x axis of graph 1.
+CATEGORY_ORDER = [
+    'Unaligned multiwall CNTs', 'Aligned Multiwall CNTs', 'Unaligned Few-wall CNTs', 
+    'Aligned Few-wall CNTs', 'Individual Multiwall CNTs', 'Individual Bundle', 
+    'Individual FWCNT', 'Conductive Polymer', 'GIC'
+]
+
+# Half-width of the horizontal spread of strip points around their box.
+STRIP_JITTER = 0.1
+
+def use_webgl(n_points):
+    return n_points > WEBGL_THRESHOLD
+
+def get_x_positions(df, x):
+    """
+    Map each value of the categorical column `x` to its position
+    on a numeric x axis.
+    """
+    values = list(df[x].unique())
+    
+    if x == 'Category':
+        order = [c for c in CATEGORY_ORDER if c in values]
+        order += [c for c in values if c not in order]
+    else:
+        order = values
+    
+    return {v: i for i,v in enumerate(order)}
+
+def construct_custom_strip(df, y, xpos, ids=None):
     traces = []
+    
+    # strip points are scatter traces placed next to their box
+    # with a fixed jitter, so they can be drawn with WebGL
+    trace_type = 'scattergl' if use_webgl(len(df)) else 'scatter'
+    jitter = np.random.default_rng(0).uniform(-STRIP_JITTER, STRIP_JITTER, len(df))
+    xs = xpos + jitter
+
+    y_vals = df[y].to_numpy()
+    refs = df['Reference'].to_numpy()
+    undoped = (df['Doped or Acid Exposure (Yes/ No)'] == 'No').to_numpy()
 
-    # one trace per category/dope combo, with custom color/symbol
-    for m in df['Category'].unique():
-        for d in df['Doped or Acid Exposure (Yes/ No)'].unique():
+    # one trace per category; dope status is encoded per point
+    for m, idx in df.groupby('Category', sort=False, observed=True).indices.items():
         
-            mask = (df['Category'] == m) & \
-                (df['Doped or Acid Exposure (Yes/ No)'] == d)
-
-            markers = {k.replace('marker_', ''):v for k,v in MARKERS[m].items()}
-            markers['opacity'] = 0.8
-            
-            if d == 'No':
-                markers['symbol'] += '-open'
-                markers['opacity'] = 0.5
-
-            traces.append({
-                'x': df.loc[mask, x],
-                'y': df.loc[mask, y],
-                'name': m, 
-                'marker': markers,
-                'customdata': df.loc[mask, 'Reference'],
-            })
+        marker = MARKERS[m]
+        symbol = marker['marker_symbol']
+
+        traces.append({
+            'x': xs[idx],
+            'y': y_vals[idx],
+            'name': m, 
+            'marker': {
+                'color': marker['marker_color'],
+                'symbol': np.where(undoped[idx], symbol + '-open', symbol),
+                'opacity': np.where(undoped[idx], 0.5, 0.8),
+            },
+            'customdata': refs[idx],
+        })
+        if ids is not None:
+            traces[-1]['ids'] = ids[idx]
 
     # Update (add) trace elements common to all traces.
     for t in traces:
-        t.update({'type': 'box',
-                  'boxpoints': 'all',
-                  'fillcolor': 'rgba(255,255,255,0)',
-                  'hoveron': 'points',
+        t.update({'type': trace_type,
+                  'mode': 'markers',
                   'hovertemplate': '%{customdata}',
-                  'line': {'color': 'rgba(255,255,255,0)'},
-                  'pointpos': 0,
                   'showlegend': True})
     
     return traces
 
 
-def construct_fig1(df, x, y, log, squash, bm):
+def construct_fig1(df, x, y, log, squash, bm, points=None):
+    """
+    Box plot of `y` per value of `x`, with every point drawn.
+
+    Benchmark lines in `bm` are labelled with annotations whose linear
+    positions are listed in `fig.layout.meta['annotation_y']`, so the
+    y-axis scale can be switched in the browser.
+
+    With `points`, a superset of `df` positionally indexed over the
+    dataset, every row of `points` is drawn, tagged with its row number
+    as plotly `ids`, while the boxes still summarize `df`. The browser
+    then hides the points the current filters exclude.
+    """
     
     df = df[df[x].notnull() & df[y].notnull()]
     
+    ids = None
+    if points is not None:
+        points = points[points[x].notnull() & points[y].notnull()]
+        ids = points.index.astype(str).to_numpy()
+    
     fig = go.Figure()
+    annotation_y = []
     
-    if squash:
+    if squash and (ids is not None or use_webgl(len(df))):
+        # box and points as separate traces, so the points can be
+        # drawn with WebGL or hidden in the browser
+        strip = df if ids is None else points
+        fig.add_trace(
+            go.Box(
+                y=df[y],
+                name='All',
+                boxpoints=False,
+                fillcolor='white',
+                line={'color':'black'},
+            )
+        )
+        trace = go.Scattergl if use_webgl(len(strip)) else go.Scatter
+        fig.add_trace(
+            trace(
+                x=['All']*len(strip),
+                y=strip[y],
+                ids=ids,
+                mode='markers',
+                marker={'color': 'black'},
+                customdata=strip['Reference'],
+                hovertemplate='%{customdata}'
+            )
+        )
+        
+    elif squash:
         print('squashing')
         fig.add_trace(
             go.Box(
@@ -163,13 +251,19 @@ def construct_fig1(df, x, y, log, squash, bm):
         
     else:
     
-        for v in df[x].unique():
-            tracedf = df.loc[df[x] == v]
-
+        strip = df if ids is None else points
+        positions = get_x_positions(strip, x)
+        xpos = df[x].map(positions).to_numpy(dtype=float)
+    
+        # one box trace per x value, named so its hover shows the label;
+        # the points are drawn by the strip traces
+        y_vals = df[y].to_numpy()
+        for v, idx in df.groupby(x, sort=False, observed=True).indices.items():
             fig.add_trace(
                 go.Box(
-                    y=tracedf[y],
-                    name=v,
+                    x=xpos[idx],
+                    y=y_vals[idx],
+                    name=str(v),
                     # Don't show or hover on outlier points
                     marker={'opacity':0},
                     hoveron='boxes',
@@ -178,7 +272,18 @@ def construct_fig1(df, x, y, log, squash, bm):
                 )
             )
 
-        fig.add_traces(construct_custom_strip(df, x, y))
+        fig.add_traces(construct_custom_strip(
+            strip, 
+            y, 
+            strip[x].map(positions).to_numpy(dtype=float),
+            ids
+        ))
+        
+        fig.update_xaxes(
+            tickmode='array',
+            tickvals=list(positions.values()),
+            ticktext=list(positions.keys())
+        )
         
     if bm:
         for m,v in bm.items():
@@ -195,31 +300,157 @@ def construct_fig1(df, x, y, log, squash, bm):
                 annotation_position='right',
                 annotation_y=math.log(v,10) if log else v
             )
+            annotation_y.append(v)
     
     fig.update_yaxes(
         type='log' if log else 'linear',
         nticks=10
     )
     
-    if x == 'Category':
-        cat_order = ['Unaligned multiwall CNTs', 'Aligned Multiwall CNTs', 'Unaligned Few-wall CNTs', 
-                     'Aligned Few-wall CNTs', 'Individual Multiwall CNTs', 'Individual Bundle', 'Individual FWCNT', 'Conductive Polymer', 'GIC']
-        cat_order = [c for c in cat_order if c in df[x].unique()]
-        print('CAT ORDER', cat_order)
-        fig.update_xaxes(categoryorder='array', categoryarray=cat_order)
-
-    
     fig.update_layout(
         showlegend=False, 
         yaxis_title=y,
-        xaxis_title=x
+        xaxis_title=x,
+        meta={'annotation_y': annotation_y}
     )
     
     return fig
 
-def construct_fig2(df, x, y, logx, logy, squash, bm):
+def construct_fit_lines(fits, color_map, squash):
+    """
+    Build one line trace per row of `fits` from `grouped_loglog_fit`.
+    """
+    traces = []
+    
+    for c, r in fits.iterrows():
+        if np.isnan(r['slope']):
+            continue
+        
+        a, b = r['slope'], r['intercept']
+        x_vals = np.linspace(r['x_min'], r['x_max'])
+        y_vals = 10**(a*np.log10(x_vals) + b)
+        
+        traces.append(
+            go.Scatter(
+                x=x_vals,
+                y=y_vals,
+                mode='lines',
+                name=c,
+                legendgroup=c,
+                showlegend=False,
+                line={'color': '#636efa' if squash else color_map.get(c)},
+                hovertemplate=(
+                    f'Category={c}<br>x=%{{x}}<br>y=%{{y}}'
+                    f'<br>a={a}<br>b={b}<extra></extra>'
+                )
+            )
+        )
+    
+    return traces
+
+def _log_bins(values, bins):
+    t = np.log10(values)
+    lo, hi = t.min(), t.max()
+    if hi == lo:
+        return np.zeros(len(t), dtype=int)
+    return np.minimum(((t - lo) / (hi - lo) * bins).astype(int), bins - 1)
+
+def decimate_points(df, x, y, max_points, bm=None, bins=DECIMATION_BINS):
+    """
+    Reduce `df` to about `max_points` rows for drawing.
+
+    Points are binned on a log-space 2D grid and every cell is capped
+    at the same number of points, so dense regions are thinned while
+    sparse ones (and outliers) survive. The grid is coarsened when more
+    cells are occupied than there are points to spare. Each category's
+    extreme points, the points nearest each benchmark in `bm`, and rows
+    with non-positive values are always kept.
+
+    Returns the reduced frame and the number of rows elided.
+    """
+    n = len(df)
+    if not max_points or n <= max_points:
+        return df, 0
+
+    xs = df[x].to_numpy(dtype=float)
+    ys = df[y].to_numpy(dtype=float)
+    positive = (xs > 0) & (ys > 0)
+    
+    keep = ~positive
+    
+    for col in (x, y):
+        grouped = df[col].groupby(df['Category'], observed=True)
+        keep[df.index.get_indexer(grouped.idxmin())] = True
+        keep[df.index.get_indexer(grouped.idxmax())] = True
+    
+    lx = np.log10(np.where(positive, xs, np.nan))
+    ly = np.log10(np.where(positive, ys, np.nan))
+    for bx, by in (bm or {}).values():
+        if bx > 0 and by > 0 and positive.any():
+            dist = (lx - np.log10(bx))**2 + (ly - np.log10(by))**2
+            keep[np.nanargmin(dist)] = True
+    
+    candidates = np.flatnonzero(positive & ~keep)
+    budget = max_points - keep.sum()
+    
+    if budget > 0 and len(candidates):
+        cells = _log_bins(xs[candidates], bins)*bins + _log_bins(ys[candidates], bins)
+        
+        # with more occupied cells than the budget, no cap fits;
+        # coarsen the grid so that every cell can keep a point
+        if len(np.unique(cells)) > budget:
+            bins = max(1, math.isqrt(budget))
+            cells = _log_bins(xs[candidates], bins)*bins + _log_bins(ys[candidates], bins)
+        
+        counts = np.bincount(cells)
+    
+        # largest per-cell cap that fits the budget
+        lo, hi = 0, counts.max()
+        while lo < hi:
+            cap = (lo + hi + 1) // 2
+            if np.minimum(counts, cap).sum() <= budget:
+                lo = cap
+            else:
+                hi = cap - 1
+    
+        # take a fixed pseudo-random subset of each cell, then spend
+        # what is left of the budget on one more point from some of
+        # the cells that were capped
+        order = np.random.default_rng(0).permutation(len(candidates))
+        rank = pd.Series(cells[order]).groupby(cells[order]).cumcount().to_numpy()
+        extra = np.flatnonzero(rank == lo)[:budget - np.minimum(counts, lo).sum()]
+        keep[candidates[order[rank < lo]]] = True
+        keep[candidates[order[extra]]] = True
+    
+    return df[keep], int(n - keep.sum())
+
+def construct_fig2(
+    df, x, y, logx, logy, squash, bm, 
+    max_points=FIG2_MAX_POINTS, 
+    points=None
+):
+    """
+    Scatter `y` against `x` with per-category log-log fits.
+
+    With `max_points`, only a decimated subset of points is drawn
+    (see `decimate_points`); fits still use every point. The number of
+    elided points is reported in `fig.layout.meta['elided']`.
+
+    With `points`, the scatter draws the rows of `points` instead, tagged
+    with their row numbers as plotly `ids` (as in `construct_fig1`);
+    fits still use `df`.
+    """
     
     df = df[df[x].notnull() & df[y].notnull()]
+    fits = grouped_loglog_fit(df, x, y, by=None if squash else 'Category')
+    
+    tag = points is not None
+    if tag:
+        df = points[points[x].notnull() & points[y].notnull()]
+    
+    df, elided = decimate_points(df, x, y, max_points, bm)
+    # plotly express groups by the raw values, not category codes
+    df = df.assign(Category=df['Category'].astype(object))
     
     symbol = color = 'Category'
     symbol_map = {k:v['marker_symbol'] for k,v in MARKERS.items()}
@@ -235,60 +466,19 @@ def construct_fig2(df, x, y, logx, logy, squash, bm):
         symbol_map=symbol_map,
         color=color,
         color_discrete_map=color_map,
-        hover_data=['Reference']
+        hover_data=['Reference'],
+        render_mode='webgl' if use_webgl(len(df)) else 'svg'
     )
-
-    if not squash:
+    fig.update_layout(meta={'elided': elided})
     
-        for c in df.Category.unique():
-            m = df.Category == c
-
-            # compute linear regression
-            lm = LinearRegression()
-            lm.fit(
-                np.log10(df[m][x].array.reshape(-1, 1)), 
-                np.log10(df[m][y].array.reshape(-1, 1))
-            )
-            # construct line
-            a, b = lm.coef_[0], lm.intercept_
-            print('DECIMAL', df[m][x].min(), df[m][x].max())
-            x_vals = np.linspace(float(df[m][x].min()), float(df[m][x].max()))
-            y_vals = 10**(a*np.log10(x_vals) + b)
-            cats = [c]*len(x_vals)
-            a_vals = [a]*len(x_vals)
-            b_vals = [b]*len(x_vals)
-            chartdata = pd.DataFrame(dict(Category=cats, x=x_vals, y=y_vals, a=a_vals, b=b_vals))
-            
-            
-            line_fig = px.line(
-                data_frame=chartdata, 
-                x='x', 
-                y='y', 
-                color='Category', 
-                color_discrete_map=color_map, 
-                hover_data=['a', 'b'],
-            )
-            line_fig.update_traces(showlegend=False)
-            # line_fig.update_layout(showlegend=False)
-            line_traces = list(line_fig.select_traces())
-            print(line_traces)
-            
-            fig.add_traces(line_traces)
-            
-    else:
-        
-        # compute linear regression
-        lm = LinearRegression()
-        lm.fit(
-            np.log10(df[x].array.reshape(-1, 1)), 
-            np.log10(df[y].array.reshape(-1, 1))
-        )
-        # construct line
-        a, b = lm.coef_[0], lm.intercept_
-        x_vals = np.linspace(df[x].min(), df[x].max())
-        y_vals = 10**(a*np.log10(x_vals) + b)
-        fig.add_traces(list(px.line(x=x_vals, y=y_vals).select_traces()))
-        
+    if tag:
+        # plotly express makes one trace per category, in row order
+        for t in fig.data:
+            rows = df.index[df['Category'] == t.name]
+            if len(rows) == len(t.x):
+                t.ids = rows.astype(str).tolist()
+
+    fig.add_traces(construct_fit_lines(fits, color_map, squash))
     
     # fig.add_traces(line_traces)
     
@@ -0,0 +1,76 @@
+import numpy as np
+
+from .db import memoize_by_version, on_dataset_load, get_dataset
+
+# Number of equal-width bins in the histogram of a numeric column.
+PROFILE_BINS = 20
+
+
+def _numeric_profile(col):
+    values = col.to_numpy(dtype=float, na_value=np.nan)
+    values = values[~np.isnan(values)]
+
+    if len(values):
+        counts, edges = np.histogram(values, bins=PROFILE_BINS)
+        lo, hi = float(values.min()), float(values.max())
+    else:
+        counts, edges = np.array([]), np.array([])
+        lo = hi = np.nan
+
+    return {
+        'min': lo,
+        'max': hi,
+        'distinct': int(len(np.unique(values))),
+        'counts': counts.tolist(),
+        'edges': edges.tolist()
+    }
+
+
+def _categorical_profile(col):
+    # distinct values in order of first appearance, as `unique()`
+    counts = col.value_counts(sort=False)
+    values = col.dropna().unique().tolist()
+
+    return {
+        'values': values,
+        'distinct': len(values),
+        'counts': [int(counts[v]) for v in values]
+    }
+
+
+def profile_column(col, kind):
+    """
+    Summarize the column `col` of type `kind` (from the data dictionary).
+
+    Every profile has `type`, `nulls` and `distinct`. Numeric profiles
+    add `min`, `max` and a histogram (`counts` over `edges`); others add
+    the distinct `values`, in order of first appearance, and their `counts`.
+    """
+    if kind == 'numeric':
+        profile = _numeric_profile(col)
+    else:
+        profile = _categorical_profile(col)
+
+    return dict(profile, type=kind, nulls=int(col.isnull().sum()))
+
+
+@memoize_by_version
+def _get_profiles(df, dd):
+    return {
+        c: profile_column(df[c], dd[c])
+        for c in df.columns if c in dd
+    }
+
+
+@on_dataset_load
+def _precompute_profiles(df, dd, version):
+    _get_profiles(df, dd, version)
+
+
+def get_column_profiles(version):
+    """
+    Return the profiles of every data dictionary column of a
+    (resolved) dataset version, as a dict keyed by column.
+    """
+    df, dd = get_dataset(version)
+    return _get_profiles(df, dd, version)